@@ -1,12 +1,46 @@
-from .fdio import *  # yapf: disable # NOQA
+# Lazily (PEP 562) provides `from .fdio import *`, submodules & `__version__`,
+# keeping `import miutil` fast.
+from importlib import import_module
 
-# version detector. Precedence: installed dist, git, 'UNKNOWN'
-try:
-    from ._dist_ver import __version__
-except ImportError:
+__all__ = [
+    "CallbackIOWrapper", "Iterable", "Path", "ZipFile", "contextmanager", "copyfileobj",
+    "create_dir", "extractall", "file_lock", "fspath", "get_cache_dir", "hasext", "is_iter", "log",
+    "logging", "makedirs", "mkdtemp", "nmerge", "nsort", "nsort_key", "nsorted_insert", "re",
+    "rmtree", "tmpdir", "tqdm"]
+# `{name: module}` for `__all__` no longer defined in `.fdio`
+_REEXPORTS = {"CallbackIOWrapper": "tqdm.utils", "ZipFile": "zipfile", "tqdm": "tqdm.auto"}
+
+
+def _version():
+    # version detector. Precedence: installed dist, git, 'UNKNOWN'
     try:
-        from setuptools_scm import get_version
+        from ._dist_ver import __version__
+    except ImportError:
+        try:
+            from setuptools_scm import get_version
+
+            __version__ = get_version(root="..", relative_to=__file__)
+        except (ImportError, LookupError):
+            __version__ = "UNKNOWN"
+    return __version__
+
+
+def __getattr__(name):
+    if name == "__version__":
+        globals()[name] = _version()
+        return globals()[name]
+    if name in _REEXPORTS:
+        return getattr(import_module(_REEXPORTS[name]), name)
+    if name in __all__:
+        return getattr(import_module(".fdio", __name__), name)
+    if not name.startswith("_"):
+        try:
+            return import_module(f".{name}", __name__)
+        except ModuleNotFoundError as exc:
+            if exc.name != f"{__name__}.{name}":
+                raise
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
-        __version__ = get_version(root="..", relative_to=__file__)
-    except (ImportError, LookupError):
-        __version__ = "UNKNOWN"
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | {"__version__"})
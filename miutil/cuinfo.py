@@ -8,15 +8,30 @@ Options:
   -f, --nvcc-flags    : print out flags for use nvcc compilation
   -c, --compute       : print out compute capabilities (strip periods)
   -d ID, --dev-id ID  : select device ID [default: None:int] for all
+  -w SEC, --watch SEC  : print memory & utilisation every SEC seconds
+                         until interrupted [default: 0:float]
+  -s MIB, --select MIB  : print a device UUID (for `CUDA_VISIBLE_DEVICES`) with
+                          at least MIB MiB free [default: None:int]
+  -p POLICY, --policy POLICY  : device selection policy
+                                (most_free|round_robin) [default: most_free]
 """
-import pynvml
-from argopt import argopt
-from subprocess import run
+import json
 import re
-import numpy as np
+from atexit import register
+from collections import deque
+from functools import lru_cache
+from os import path
+from subprocess import run
+from threading import Event, Thread
+from time import sleep, time
 
-__all__ = ["num_devices", "compute_capability", "memory", "name", "nvcc_flags"]
+from .fdio import file_lock, get_cache_dir
 
+__all__ = [
+    "num_devices", "compute_capability", "memory", "name", "uuid", "nvcc_flags", "Sampler",
+    "select_device"]
+# `{"claims": {dev_id: time}, "last": dev_id}` of `select_device`, in `~/.miutil`
+SELECT_STATE = "cuinfo.json"
 
 # def nvmlDeviceGetCudaComputeCapability(handle):
 #     major = pynvml.c_int()
@@ -35,69 +50,267 @@ __all__ = ["num_devices", "compute_capability", "memory", "name", "nvcc_flags"]
 #     return [major.value, minor.value]
 
 
+@lru_cache()
+def _nvml():
+    """`pynvml`, initialised once per process (shut down at exit)"""
+    import pynvml
+
+    pynvml.nvmlInit()
+    register(pynvml.nvmlShutdown)
+    return pynvml
+
+
+@lru_cache()
 def num_devices():
     """returns total number of devices"""
-    pynvml.nvmlInit()
-    return pynvml.nvmlDeviceGetCount()
+    return _nvml().nvmlDeviceGetCount()
 
 
-def get_handle(dev_id=-1):
-    """allows negative indexing"""
-    pynvml.nvmlInit()
-    dev_id = num_devices() + dev_id if dev_id < 0 else dev_id
+@lru_cache()
+def _handle(dev_id):
+    pynvml = _nvml()
     try:
         return pynvml.nvmlDeviceGetHandleByIndex(dev_id)
     except pynvml.NVMLError:
         raise IndexError("invalid dev_id")
 
 
-def compute_capability(dev_id=-1):
-    """returns compute capability (major, minor)"""
+def get_handle(dev_id=-1):
+    """allows negative indexing"""
+    return _handle(num_devices() + dev_id if dev_id < 0 else dev_id)
+
 
+@lru_cache()
+def _compute_capabilities():
+    """`(major, minor)` for all devices via one `nvidia-smi` query"""
     # > test if CUDA is installed
     try:
-        nvcc = run(
-            ['nvcc', '--version'],
-            capture_output=True,
-            text=True)
-    except:
-        return tuple([0,0])
-
-    
-    nsmi = run(
-        ['nvidia-smi', '--query-gpu=compute_cap', '--format=csv,noheader'],
-        capture_output=True,
-        text=True)
-
-    cc = [int(m) for m in re.findall(r'\d+', nsmi.stdout)]
-    cc = np.reshape(cc, (-1,2))
-
-    return tuple(cc[dev_id])
+        run(["nvcc", "--version"], capture_output=True, text=True)
+    except OSError:
+        return None
+
+    nsmi = run(["nvidia-smi", "--query-gpu=compute_cap", "--format=csv,noheader"],
+               capture_output=True, text=True)
+    cc = [int(m) for m in re.findall(r"\d+", nsmi.stdout)]
+    return tuple(zip(cc[::2], cc[1::2]))
+
+
+def compute_capability(dev_id=-1):
+    """returns compute capability (major, minor)"""
+    cc = _compute_capabilities()
+    if cc is None:
+        return (0, 0)
+    return cc[dev_id]
     # > this was the old, unsustainable way...:
     # return tuple(nvmlDeviceGetCudaComputeCapability(get_handle(dev_id)))
 
 
 def memory(dev_id=-1):
     """returns memory (total, free, used)"""
-    mem = pynvml.nvmlDeviceGetMemoryInfo(get_handle(dev_id))
+    mem = _nvml().nvmlDeviceGetMemoryInfo(get_handle(dev_id))
     return (mem.total, mem.free, mem.used)
 
 
+@lru_cache()
+def _name(dev_id):
+    res = _nvml().nvmlDeviceGetName(_handle(dev_id))
+    try:
+        return res.decode("U8") # pynvml<11.5
+    except AttributeError:
+        return res
+
+
 def name(dev_id=-1):
     """returns device name"""
-    res = pynvml.nvmlDeviceGetName(get_handle(dev_id))
+    return _name(num_devices() + dev_id if dev_id < 0 else dev_id)
+
+
+def _free_memory(devices):
+    """free memory of all `devices` in one NVML pass"""
+    pynvml = _nvml()
+    return [pynvml.nvmlDeviceGetMemoryInfo(get_handle(i)).free for i in devices]
+
+
+def select_device(min_free=0, policy="most_free", devices=None, hold=10):
+    """
+    Pick a device with at least `min_free` bytes of free memory.
+
+    Concurrent callers on a node are coordinated via an advisory lock on
+    `~/.miutil/cuinfo.json`: devices selected within the last `hold` seconds
+    (whose memory may not yet be allocated) are only picked as a last resort.
+
+    Args:
+      min_free (int): required free memory (bytes)
+      policy (str): "most_free" or "round_robin"
+      devices (list): candidate device IDs (default: all)
+      hold (float): seconds for which a selection is de-prioritised
+    Returns:
+      int: (NVML) device ID, or `None` if no device has `min_free` memory.
+        N.B.: use `uuid(dev_id)` for `CUDA_VISIBLE_DEVICES`, since
+        CUDA's default (`FASTEST_FIRST`) ordering may differ.
+    """
+    if policy not in ("most_free", "round_robin"):
+        raise ValueError(f"unknown policy:{policy}")
+    devices = list(range(num_devices()) if devices is None else devices)
+    free = dict(zip(devices, _free_memory(devices)))
+    candidates = [i for i in devices if free[i] >= min_free]
+    if not candidates:
+        return None
+
+    fstate = path.join(get_cache_dir(), SELECT_STATE)
+    with file_lock(f"{fstate}.lock"):
+        try:
+            with open(fstate) as fd:
+                state = json.load(fd)
+        except (IOError, ValueError):
+            state = {}
+        now = time()
+        claims = {int(i): t for i, t in state.get("claims", {}).items() if now - t < hold}
+        if policy == "most_free":
+            candidates.sort(key=lambda i: -free[i])
+        else:
+            last = state.get("last", -1)
+            candidates.sort(key=lambda i: (i <= last, i))
+        # stable: first unclaimed candidate, if any
+        dev_id = min(candidates, key=lambda i: i in claims)
+        claims[dev_id] = now
+        with open(fstate, "w") as fd:
+            json.dump({"claims": claims, "last": dev_id}, fd)
+    return dev_id
+
+
+@lru_cache()
+def _uuid(dev_id):
+    res = _nvml().nvmlDeviceGetUUID(_handle(dev_id))
     try:
         return res.decode("U8") # pynvml<11.5
     except AttributeError:
         return res
 
 
+def uuid(dev_id=-1):
+    """
+    returns device UUID (usable in `CUDA_VISIBLE_DEVICES` regardless of
+    `CUDA_DEVICE_ORDER`, unlike NVML indices)
+    """
+    return _uuid(num_devices() + dev_id if dev_id < 0 else dev_id)
+
+
 def nvcc_flags(dev_id=-1):
     return "-gencode=arch=compute_{0:d}{1:d},code=compute_{0:d}{1:d}".format(
         *compute_capability(dev_id))
 
 
+class Sampler(object):
+    """
+    Background NVML telemetry for multiple devices.
+
+    Each sample is `(time, ((free, used, util), ...))` with one entry per device,
+    stored in a fixed-length ring buffer (`collections.deque`, so appends
+    and copies need no explicit locking).
+
+    >>> with Sampler(interval=0.5) as sampler:
+    ...     recon()
+    >>> sampler.stats()[0]["min_free"]
+
+    Args:
+      interval (float): seconds between samples
+      maxlen (int): number of samples retained
+      devices (list): device IDs (default: all)
+    """
+    def __init__(self, interval=0.1, maxlen=1024, devices=None):
+        self.interval = interval
+        self.devices = list(range(num_devices()) if devices is None else devices)
+        self.samples = deque(maxlen=maxlen)
+        self._stop = Event()
+        self._thread = None
+
+    def sample(self):
+        """Record (and return) one sample of all devices"""
+        pynvml = _nvml()
+        res = []
+        for dev_id in self.devices:
+            handle = get_handle(dev_id)
+            mem = pynvml.nvmlDeviceGetMemoryInfo(handle)
+            try:
+                util = pynvml.nvmlDeviceGetUtilizationRates(handle).gpu
+            except pynvml.NVMLError:
+                util = None
+            res.append((mem.free, mem.used, util))
+        res = time(), tuple(res)
+        self.samples.append(res)
+        return res
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        """Start sampling in a background daemon thread"""
+        if self._thread is None:
+            self._stop.clear()
+            self.sample()
+            self._thread = Thread(target=self._run, name="cuinfo.Sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the background thread (recording a final sample)"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.sample()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        """
+        Returns:
+          dict: `{dev_id: {"samples", "min_free", "mean_free", "peak_used",
+            "mean_util", "max_util"}}` over the buffered samples
+        """
+        samples = [i for _, i in self.samples.copy()]
+        res = {}
+        for i, dev_id in enumerate(self.devices):
+            free, used, util = zip(*(s[i] for s in samples)) if samples else ((), (), ())
+            util = [u for u in util if u is not None]
+            res[dev_id] = {
+                "samples": len(free), "min_free": min(free, default=None),
+                "mean_free": sum(free) / len(free) if free else None,
+                "peak_used": max(used, default=None),
+                "mean_util": sum(util) / len(util) if util else None,
+                "max_util": max(util, default=None)}
+        return res
+
+
+def _watch(devices, interval):
+    sampler = Sampler(interval, devices=devices)
+    try:
+        while True:
+            t, res = sampler.sample()
+            for dev_id, (free, used, util) in zip(devices, res):
+                print("Device {:2d}:free:{:d} MiB:used:{:d} MiB:util:{}%".format(
+                    dev_id, free >> 20, used >> 20, "-" if util is None else util))
+            sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    for dev_id, stats in sampler.stats().items():
+        # interrupted before the first sample
+        if not stats["samples"]:
+            continue
+        print("Device {:2d}:min free:{:d} MiB:mean free:{:.0f} MiB:peak used:{:d} MiB".format(
+            dev_id, stats["min_free"] >> 20, stats["mean_free"] / (1 << 20),
+            stats["peak_used"] >> 20))
+
+
 def main(*args, **kwargs):
+    from argopt import argopt
+
     args = argopt(__doc__).parse_args(*args, **kwargs)
     noargs = True
     devices = range(num_devices()) if args.dev_id is None else [args.dev_id]
@@ -111,6 +324,15 @@ def main(*args, **kwargs):
     if args.compute:
         print(" ".join(sorted({"%d%d" % compute_capability(i) for i in devices})[::-1]))
         noargs = False
+    if args.select is not None:
+        dev_id = select_device(args.select << 20, args.policy, devices)
+        if dev_id is None:
+            raise SystemExit(f"no device with {args.select} MiB free")
+        print(uuid(dev_id))
+        noargs = False
+    if args.watch:
+        _watch(list(devices), args.watch)
+        noargs = False
     if noargs:
         for dev_id in devices:
             print("Device {:2d}:{}:compute capability:{:d}.{:d}".format( # NOQA: P101
@@ -1,15 +1,24 @@
+import heapq
 import logging
 import re
 from collections.abc import Iterable
 from contextlib import contextmanager
-from os import fspath, makedirs
+from fnmatch import fnmatch
+from functools import lru_cache
+from os import W_OK, PathLike, access, fspath, makedirs, path
 from pathlib import Path
 from shutil import copyfileobj, rmtree
+from struct import Struct, unpack
 from tempfile import mkdtemp
-from zipfile import ZipFile
+from threading import Lock
+from threading import local as local_data
+from zlib import crc32, decompressobj
 
-from tqdm.auto import tqdm
-from tqdm.utils import CallbackIOWrapper
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
 
 log = logging.getLogger(__name__)
 
@@ -24,6 +33,18 @@ def create_dir(pth):
             log.warning("cannot create:%s:%s", pth, exc)
 
 
+def get_cache_dir(cache_dir=None):
+    """`cache_dir` (default `~/.miutil`), falling back to `/tmp/.miutil`"""
+    if cache_dir is None:
+        cache_dir = path.join("~", ".miutil")
+    cache_dir = path.expanduser(fspath(cache_dir))
+    create_dir(cache_dir)
+    if not access(cache_dir, W_OK):
+        cache_dir = path.join("/tmp", ".miutil")
+        create_dir(cache_dir)
+    return cache_dir
+
+
 def is_iter(x):
     return isinstance(x, Iterable) and not isinstance(x, (str, bytes))
 
@@ -42,34 +63,352 @@ def tmpdir(*args, **kwargs):
     rmtree(d)
 
 
-def extractall(fzip, dest, desc="Extracting"):
-    """zipfile.Zipfile(fzip).extractall(dest) with progress"""
-    dest = Path(dest).expanduser()
-    with ZipFile(fzip) as zipf, tqdm(
-            desc=desc,
-            unit="B",
-            unit_scale=True,
-            unit_divisor=1024,
-            total=sum(getattr(i, "file_size", 0) for i in zipf.infolist()),
-    ) as pbar:
-        for i in zipf.infolist():
-            if not getattr(i, "file_size", 0): # directory
-                zipf.extract(i, fspath(dest))
+@contextmanager
+def file_lock(fname, shared=False):
+    """
+    Advisory inter-process lock on `fname` (created if need be).
+    `shared` (read) locks are exclusive on Windows.
+    """
+    with open(fspath(fname), "a+b") as fd:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            fd.seek(0)
+            msvcrt.locking(fd.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield fd
+        finally:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
             else:
-                (dest / i.filename).parent.mkdir(parents=True, exist_ok=True)
-                with zipf.open(i) as fi, (dest / i.filename).open(mode="wb") as fo:
-                    copyfileobj(CallbackIOWrapper(pbar.update, fi), fo)
-                mode = (i.external_attr >> 16) & 0o777
-                if mode:
-                    (dest / i.filename).chmod(mode)
-                    log.debug(oct((i.external_attr >> 16) & 0o777))
+                fd.seek(0)
+                msvcrt.locking(fd.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _select(names, include=None, exclude=None):
+    """filter `names` by `include` & `exclude` glob pattern(s)"""
+    include = (include,) if include and not is_iter(include) else include
+    exclude = (exclude,) if exclude and not is_iter(exclude) else exclude
+    for name in names:
+        if include and not any(fnmatch(name, i) for i in include):
+            continue
+        if exclude and any(fnmatch(name, i) for i in exclude):
+            continue
+        yield name
+
+
+def _seekable(fd):
+    return hasattr(fd, "seek") and getattr(fd, "seekable", lambda: True)()
+
+
+def _member_path(dest, name):
+    """
+    `dest / name` without drives, absolute paths or `..` components
+    (as per `ZipFile._extract_member`), or `None` if empty.
+    Raises:
+      ValueError: if the result is outside `dest` (e.g. via symlinks).
+    """
+    parts = [i for i in re.split(r"[\\/]", path.splitdrive(name)[1]) if i not in ("", ".", "..")]
+    if not parts:
+        return None
+    res = dest.joinpath(*parts)
+    if dest.resolve() not in res.resolve().parents:
+        raise ValueError(f"{name}: outside {dest}")
+    return res
+
+
+def _extract_member(zipf, i, dest, update):
+    from tqdm.utils import CallbackIOWrapper
+
+    if not getattr(i, "file_size", 0): # directory
+        zipf.extract(i, fspath(dest))
+    else:
+        fout = _member_path(dest, i.filename)
+        fout.parent.mkdir(parents=True, exist_ok=True)
+        with zipf.open(i) as fi, fout.open(mode="wb") as fo:
+            copyfileobj(CallbackIOWrapper(update, fi), fo)
+        mode = (i.external_attr >> 16) & 0o777
+        if mode:
+            fout.chmod(mode)
+            log.debug(oct((i.external_attr >> 16) & 0o777))
+
+
+def extractall(fzip, dest, desc="Extracting", include=None, exclude=None, n_jobs=None):
+    """
+    zipfile.Zipfile(fzip).extractall(dest) with progress
+
+    Args:
+      fzip: path, file, or non-seekable stream (e.g. the `raw` attribute
+        of a streaming `requests` response, extracted on-the-fly).
+      include (str or list): optional glob pattern(s) of members to extract.
+      exclude (str or list): optional glob pattern(s) of members to skip.
+      n_jobs (int): threads for concurrent member decompression
+        (each with its own `ZipFile` handle, so `fzip` must be a path or
+        a named file). Default: serial.
+    """
+    from zipfile import ZipFile
+
+    from tqdm.auto import tqdm
+
+    dest = Path(dest).expanduser()
+    if hasattr(fzip, "read") and not _seekable(fzip):
+        return _extractall_stream(fzip, dest, desc=desc, include=include, exclude=exclude)
+    src = fzip if not hasattr(fzip, "read") else getattr(fzip, "name", None)
+    if not isinstance(src, (str, PathLike)) or not Path(src).is_file():
+        src = None
+    with ZipFile(fzip) as zipf:
+        members = {i.filename: i for i in zipf.infolist()}
+        members = [members[i] for i in _select(members, include, exclude)]
+        with tqdm(desc=desc, unit="B", unit_scale=True, unit_divisor=1024,
+                  total=sum(getattr(i, "file_size", 0) for i in members)) as pbar:
+            if not (n_jobs and n_jobs > 1 and src and len(members) > 1):
+                for i in members:
+                    _extract_member(zipf, i, dest, pbar.update)
+                return
+
+            lock, local, handles = Lock(), local_data(), []
+
+            def update(n):
+                with lock:
+                    pbar.update(n)
+
+            def extract(i):
+                if not hasattr(local, "zipf"):
+                    local.zipf = ZipFile(fspath(src))
+                    handles.append(local.zipf)
+                _extract_member(local.zipf, i, dest, update)
+
+            # directories first
+            for i in members:
+                if not getattr(i, "file_size", 0):
+                    _extract_member(zipf, i, dest, update)
+            try:
+                from concurrent.futures import ThreadPoolExecutor
+
+                with ThreadPoolExecutor(n_jobs) as pool:
+                    list(pool.map(extract, [i for i in members if getattr(i, "file_size", 0)]))
+            finally:
+                for zipf_i in handles:
+                    zipf_i.close()
+
+
+class _StreamReader(object):
+    """exact-size `read` with `unread` (pushback) for non-seekable streams"""
+    def __init__(self, fd):
+        self.fd = fd
+        self.buf = b""
+
+    def read(self, size):
+        while len(self.buf) < size:
+            chunk = self.fd.read(max(size - len(self.buf), 1 << 16))
+            if not chunk:
+                break
+            self.buf += chunk
+        res, self.buf = self.buf[:size], self.buf[size:]
+        return res
+
+    def read1(self, size=1 << 16):
+        """up to `size` bytes"""
+        if self.buf:
+            res, self.buf = self.buf[:size], self.buf[size:]
+            return res
+        return self.fd.read(size)
+
+    def unread(self, data):
+        self.buf = data + self.buf
+
+
+_ZIP_LOCAL = Struct("<4s5H3L2H")
+_ZIP_CENTRAL = Struct("<4s6H3L5H2L")
+# zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED
+_ZIP_STORED, _ZIP_DEFLATED = 0, 8
+
+
+def _zip64_sizes(extra, csize, usize):
+    """(compressed, uncompressed) sizes from zip64 `extra` field if needed"""
+    while len(extra) >= 4:
+        tag, size = unpack("<2H", extra[:4])
+        if tag == 1:
+            data = extra[4:4 + size]
+            if usize == 0xFFFFFFFF:
+                usize, data = unpack("<Q", data[:8])[0], data[8:]
+            if csize == 0xFFFFFFFF:
+                csize = unpack("<Q", data[:8])[0]
+            return csize, usize, True
+        extra = extra[4 + size:]
+    return csize, usize, False
+
+
+def _stored_descriptor_data(fi, name, zip64):
+    """
+    Yields data of a stored member of unknown size (i.e. followed by a data
+    descriptor), found by scanning for a signature with matching CRC & size.
+    """
+    dsize = 16 if zip64 else 8
+    check, size, buf = 0, 0, b""
+    while True:
+        chunk = fi.read1()
+        if not chunk:
+            raise EOFError(f"{name}: truncated")
+        buf += chunk
+        i = buf.find(b"PK\x07\x08")
+        while i >= 0 and len(buf) >= i + 8 + dsize:
+            crc, dlen = unpack("<LQ" if zip64 else "<LL", buf[i + 4:i + 8 + dsize//2])
+            if crc == crc32(buf[:i], check) and dlen == size + i:
+                yield buf[:i]
+                fi.unread(buf[i + 8 + dsize:])
+                return
+            i = buf.find(b"PK\x07\x08", i + 1)
+        # keep a possible (partial) signature
+        n = len(buf) - 3 if i < 0 else i
+        if n > 0:
+            check, size = crc32(buf[:n], check), size + n
+            yield buf[:n]
+            buf = buf[n:]
+
+
+def _zip_member_data(fi, name, method, descriptor, crc, csize, zip64):
+    """Yields decompressed, CRC-checked data of a member from a `_StreamReader`"""
+    if descriptor and method == _ZIP_STORED:
+        yield from _stored_descriptor_data(fi, name, zip64)
+        return
+    dec = decompressobj(-15) if method == _ZIP_DEFLATED else None
+    check, left = 0, csize
+    while (not dec.eof) if descriptor else left:
+        chunk = fi.read1(1 << 16 if descriptor else min(left, 1 << 16))
+        if not chunk:
+            raise EOFError(f"{name}: truncated")
+        left -= len(chunk)
+        if dec is not None:
+            chunk = dec.decompress(chunk)
+            if dec.eof and dec.unused_data:
+                fi.unread(dec.unused_data)
+        check = crc32(chunk, check)
+        yield chunk
+    if descriptor:
+        data = fi.read(4)
+        if data != b"PK\x07\x08": # optional signature
+            fi.unread(data)
+        crc = unpack("<L", fi.read(4))[0]
+        fi.read(16 if zip64 else 8)
+    if check != crc:
+        raise IOError(f"{name}: CRC mismatch")
+
+
+def _check_zip_signature(header, expected):
+    """Raises if `header` (4 bytes) is not in `expected` signatures"""
+    if header[:4] in expected:
+        return
+    if len(header) < 4:
+        raise EOFError("truncated zip")
+    from zipfile import BadZipFile
+
+    raise BadZipFile(f"not a zip file (unexpected signature {header[:4]!r})")
+
+
+def _extractall_stream(fd, dest, desc="Extracting", include=None, exclude=None):
+    """
+    `extractall` from a non-seekable stream of a zip file by parsing local
+    file headers in order. File modes are applied once the trailing central
+    directory is reached.
+    """
+    from zipfile import BadZipFile
+
+    from tqdm.auto import tqdm
+
+    fi = _StreamReader(fd)
+    extracted = {}
+    with tqdm(desc=desc, unit="B", unit_scale=True, unit_divisor=1024) as pbar:
+        while True:
+            header = fi.read(4)
+            if header != b"PK\x03\x04":
+                break
+            header += fi.read(_ZIP_LOCAL.size - 4)
+            if len(header) < _ZIP_LOCAL.size:
+                raise EOFError("truncated zip")
+            (_, _, flag, method, _, _, crc, csize, usize, nlen, xlen) = _ZIP_LOCAL.unpack(header)
+            name = fi.read(nlen).decode("U8" if flag & 0x800 else "cp437")
+            csize, usize, zip64 = _zip64_sizes(fi.read(xlen), csize, usize)
+            if flag & 1:
+                raise BadZipFile(f"{name}: encrypted members are not supported")
+            if method not in (_ZIP_STORED, _ZIP_DEFLATED):
+                raise BadZipFile(f"{name}: unsupported compression method {method}")
+            fout = None
+            target = _member_path(dest, name) if any(_select([name], include, exclude)) else None
+            if target is not None:
+                if name.endswith("/"):
+                    target.mkdir(parents=True, exist_ok=True)
+                else:
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    fout = target.open(mode="wb")
+                extracted[name] = target
+            try:
+                for chunk in _zip_member_data(fi, name, method, flag & 8, crc, csize, zip64):
+                    if fout is not None:
+                        fout.write(chunk)
+                        pbar.update(len(chunk))
+            finally:
+                if fout is not None:
+                    fout.close()
+        _check_zip_signature(header, (b"PK\x01\x02", b"PK\x05\x06"))
+
+        # central directory (for file modes)
+        while header[:4] == b"PK\x01\x02":
+            header += fi.read(_ZIP_CENTRAL.size - len(header))
+            if len(header) < _ZIP_CENTRAL.size:
+                raise EOFError("truncated zip")
+            fields = _ZIP_CENTRAL.unpack(header)
+            nlen, xlen, clen, attr = fields[10], fields[11], fields[12], fields[15]
+            name = fi.read(nlen).decode("U8" if fields[3] & 0x800 else "cp437")
+            fi.read(xlen + clen)
+            mode = (attr >> 16) & 0o777
+            if mode and name in extracted and not name.endswith("/"):
+                extracted[name].chmod(mode)
+            header = fi.read(4)
+        # end of central directory (zip64 or otherwise)
+        _check_zip_signature(header, (b"PK\x05\x06", b"PK\x06\x06"))
+
+
+RE_NUM = re.compile(r"([0-9][0-9.]*e[-+][0-9]+|[0-9]+\.[0-9]+|[0-9]+)")
+
+
+def _nsort_key(fname, split=RE_NUM.split):
+    parts = split(fspath(fname))
+    parts[1::2] = map(float, parts[1::2])
+    return tuple(parts)
+
+
+_nsort_key_cached = lru_cache(maxsize=1 << 16)(_nsort_key)
+
+
+def nsort_key(fname):
+    """Natural sort key (tuple of alternating `str` & `float`) for path-like `fname`"""
+    return _nsort_key_cached(fspath(fname))
 
 
 def nsort(fnames):
-    """Sort a file list, automatically detecting embedded numbers"""
-    def path2parts(fname):
-        parts = re.split(r"([0-9][0-9.]*e[-+][0-9]+|[0-9]+\.[0-9]+|[0-9]+)", fname)
-        parts[1::2] = map(float, parts[1::2])
-        return parts
+    """Sort a file (str or path-like) list, automatically detecting embedded numbers"""
+    return sorted(fnames, key=_nsort_key)
+
+
+def nsorted_insert(fnames, fname):
+    """
+    Insert `fname` into already `nsort`ed list `fnames` (in-place),
+    keeping it sorted.
+    Returns:
+      int: index of insertion
+    """
+    key, lo, hi = nsort_key(fname), 0, len(fnames)
+    while lo < hi:
+        mid = (lo+hi) // 2
+        if key < nsort_key(fnames[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    fnames.insert(lo, fname)
+    return lo
+
 
-    return sorted(fnames, key=path2parts)
+def nmerge(*iterables):
+    """Lazily merge multiple `nsort`ed iterables (e.g. existing & new files)"""
+    return heapq.merge(*iterables, key=nsort_key)
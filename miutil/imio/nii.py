@@ -1,18 +1,29 @@
 """NIfTI I/O"""
 import gzip
+import json
 import logging
 import numbers
 import os.path
 import re
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from io import BytesIO, IOBase
+from shutil import copyfileobj
+from tempfile import mkstemp
 
 import nibabel as nib
 import numpy as np
 
-from ..fdio import create_dir, fspath, hasext
+from ..fdio import create_dir, fspath, hasext, is_iter
 from . import RE_NII_GZ
 
 RE_GZ = re.compile(r"^(.+)(\.gz)$", flags=re.I)
+#: per-directory file name used by `nii_index`
+NII_INDEX = ".miutil_nii_index.json"
+#: environment variable for the default number of gzip compression threads
+GZIP_THREADS_ENV = "MIUTIL_GZIP_THREADS"
 log = logging.getLogger(__name__)
 if sys.version_info[0] < 3:
     string_types = basestring, # NOQA: F821
@@ -28,34 +39,328 @@ def file_parts(fname, regex=RE_NII_GZ):
     return os.path.dirname(fname), root, ext
 
 
-def nii_ugzip(imfile, outpath=""):
-    """Uncompress *.gz file"""
+def nii_ugzip(imfile, outpath="", chunk_size=None, inplace=False):
+    """
+    Uncompress *.gz file
+    Arguments:
+        chunk_size: bytes to stream at a time (default: `shutil.copyfileobj`).
+        inplace: remove `imfile` on success.
+    """
     assert hasext(imfile, "gz")
     dout, fout, ext = file_parts(imfile, RE_GZ)
-    with gzip.open(fspath(imfile), "rb") as f:
-        s = f.read()
-    # write the uncompressed data
     fout = os.path.join(fspath(outpath) or dout, fout)
-    with open(fout, "wb") as f:
-        f.write(s)
+    with gzip.open(fspath(imfile), "rb") as fi:
+        _write_stream(fi, fout, chunk_size=chunk_size)
+    if inplace:
+        os.remove(fspath(imfile))
     return fout
 
 
-def nii_gzip(imfile, outpath=""):
-    """Compress *.gz file"""
+def nii_gzip(imfile, outpath="", chunk_size=None, compresslevel=9, inplace=False, threads=None):
+    """
+    Compress *.gz file
+    Arguments:
+        chunk_size: bytes to stream at a time (default: `shutil.copyfileobj`,
+            or 4 MiB blocks if `threads > 1`).
+        compresslevel: 1 (fastest) to 9 (smallest).
+        inplace: remove `imfile` on success.
+        threads: number of compression threads (default: `$MIUTIL_GZIP_THREADS`
+            or 1, <0: all CPUs). Multiple threads compress blocks
+            independently, writing one gzip member per block.
+    """
     imfile = fspath(imfile)
-    with open(imfile, "rb") as f:
-        d = f.read()
-    # write the compressed data
     fout = imfile + ".gz"
     if outpath:
         fout = os.path.join(fspath(outpath), os.path.basename(fout))
-    with gzip.open(fout, "wb") as f:
-        f.write(d)
+    with open(imfile, "rb") as fi:
+        _write_stream(fi, fout, chunk_size=chunk_size, compresslevel=compresslevel,
+                      threads=threads)
+    if inplace:
+        os.remove(imfile)
     return fout
 
 
-def getnii(fim, nan_replace=None, output='image'):
+def _gzip_threads(threads=None):
+    """`threads`, defaulting to `$MIUTIL_GZIP_THREADS` or 1. Negative: all CPUs"""
+    if threads is None:
+        threads = int(os.environ.get(GZIP_THREADS_ENV, "") or 1)
+    return (os.cpu_count() or 1) if threads < 0 else threads
+
+
+class _GzipBlockWriter(IOBase):
+    """
+    Write-only file object compressing into `fo` using `threads`, as
+    concatenated gzip members of `chunk_size` (uncompressed) bytes each.
+    Only supports no-op seeks (as required by `nibabel`).
+    """
+    def __init__(self, fo, threads, chunk_size=None, compresslevel=9):
+        self.fo = fo
+        self.threads = threads
+        self.chunk_size = chunk_size or 4 * 2**20
+        self.compresslevel = compresslevel
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.pending = deque()
+        self.buf = bytearray()
+        self.pos = 0
+        self.members = 0
+
+    def _submit(self, block):
+        self.pending.append(self.pool.submit(gzip.compress, block, self.compresslevel))
+        self.members += 1
+        while len(self.pending) > 2 * self.threads: # bound memory
+            self.fo.write(self.pending.popleft().result())
+
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        self.buf += data
+        self.pos += len(data)
+        while len(self.buf) >= self.chunk_size:
+            self._submit(bytes(self.buf[:self.chunk_size]))
+            del self.buf[:self.chunk_size]
+        return len(data)
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=0):
+        if (offset, whence) in ((self.pos, 0), (0, 1)):
+            return self.pos
+        raise OSError("cannot seek in a compressed stream")
+
+    def seekable(self):
+        return False
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    @property
+    def closed(self):
+        return self.pool is None
+
+    def close(self):
+        """Compress & write any remaining data (without closing `fo`)"""
+        if self.closed:
+            return
+        try:
+            if self.buf or not self.members: # empty input: one empty member
+                self._submit(bytes(self.buf))
+            while self.pending:
+                self.fo.write(self.pending.popleft().result())
+        finally:
+            self.discard()
+
+    def discard(self):
+        """Drop any remaining data"""
+        if self.closed:
+            return
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.pool.shutdown()
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def _gzip_blocks(fi, fo, threads, chunk_size=None, compresslevel=9):
+    """
+    Compress file object `fi` into `fo` in parallel, as concatenated
+    gzip members of `chunk_size` (uncompressed) bytes each.
+    """
+    chunk_size = chunk_size or 4 * 2**20
+    with _GzipBlockWriter(fo, threads, chunk_size=chunk_size, compresslevel=compresslevel) as fz:
+        copyfileobj(fi, fz, chunk_size)
+
+
+def _write_stream(fi, fout, chunk_size=None, compresslevel=None, threads=None):
+    """
+    Copy file object `fi` to path `fout` (gzipped if `compresslevel`),
+    streaming `chunk_size` bytes at a time. Removes partial output on error.
+    """
+    args = (chunk_size,) if chunk_size else ()
+    threads = _gzip_threads(threads)
+    try:
+        if compresslevel is None:
+            with open(fout, "wb") as fo:
+                copyfileobj(fi, fo, *args)
+        elif threads > 1:
+            with open(fout, "wb") as fo:
+                _gzip_blocks(fi, fo, threads, chunk_size=chunk_size, compresslevel=compresslevel)
+        else:
+            with gzip.open(fout, "wb", compresslevel=compresslevel) as fo:
+                copyfileobj(fi, fo, *args)
+    except (Exception, KeyboardInterrupt):
+        if os.path.exists(fout):
+            os.remove(fout)
+        raise
+
+
+def _orientation(affine):
+    """NIfTI affine -> (transpose, flip) as used by `getnii`"""
+    # > get orientations from the affine
+    ornt = nib.io_orientation(affine)
+    trnsp = tuple(np.flip(np.argsort(ornt[:, 0])))
+    flip = tuple(np.int8(ornt[:, 1]))
+    return trnsp, flip
+
+
+def _reorient(imr, trnsp, flip):
+    """Flip y-axis and z-axis and then transpose (returns a view)"""
+    if imr.ndim == 4:   # dynamic
+        return np.transpose(imr[::-flip[0], ::-flip[1], ::-flip[2], :], (3,) + trnsp)
+    elif imr.ndim == 3: # static
+        return np.transpose(imr[::-flip[0], ::-flip[1], ::-flip[2]], trnsp)
+    return imr
+
+
+def nii_header(fim):
+    """
+    Read just the NIfTI-1 header (the first 348 bytes, so only as much of
+    `*.nii.gz` as needed is decompressed) without creating an image.
+    Falls back to `nib.load(fim).header` for other formats.
+    """
+    fim = fspath(fim)
+    if RE_NII_GZ.search(fim):
+        with (gzip.open if hasext(fim, "gz") else open)(fim, "rb") as fd:
+            blk = fd.read(nib.Nifti1Header.template_dtype.itemsize)
+        try:
+            hdr = nib.Nifti1Header(blk)
+        except Exception as exc:
+            log.debug("cannot parse NIfTI-1 header:%s:%s", fim, exc)
+        else:
+            if hdr['magic'] == b"n+1":
+                return hdr
+    return nib.load(fim).header
+
+
+def _nii_meta(fim, stat):
+    """Index entry for `nii_index`"""
+    hdr = nii_header(fim)
+    frm = re.search(r"(?<=_frm)\d+", os.path.basename(fim))
+    return {
+        'mtime': stat.st_mtime_ns, 'size': stat.st_size,
+        'shape': [int(i) for i in hdr.get_data_shape()], 'dtype': hdr.get_data_dtype().str,
+        'affine': hdr.get_best_affine().tolist(), 'voxsize': [float(i) for i in hdr.get_zooms()],
+        'frame': int(frm.group(0)) if frm else None}
+
+
+def nii_index(fims, save=True):
+    """
+    Header metadata of NIfTI files, cached in a per-directory `NII_INDEX`
+    file (entries are refreshed when a file's mtime or size changes).
+    Arguments:
+        fims: list of NIfTI files, or a directory (to index all NIfTI files).
+        save: whether to (try to) save updated indices.
+    Return:
+        dictionary of `{file: {'shape', 'dtype', 'affine', 'voxsize', 'frame',
+        'mtime', 'size'}}` (in on-disk order, i.e. not reoriented as per `getnii`).
+    """
+    if not is_iter(fims) and os.path.isdir(fspath(fims)):
+        fims = [os.path.join(fspath(fims), i) for i in os.listdir(fspath(fims))]
+        fims = sorted(i for i in fims if RE_NII_GZ.search(i))
+    fims = [fspath(i) for i in fims]
+    dirs = {}
+    for fim in fims:
+        dirs.setdefault(os.path.dirname(fim), []).append(fim)
+
+    res = {}
+    for dname, dfims in dirs.items():
+        findex = os.path.join(dname, NII_INDEX)
+        try:
+            with open(findex) as fd:
+                index = json.load(fd)
+        except (OSError, ValueError):
+            index = {}
+        changed = False
+        for fim in dfims:
+            stat = os.stat(fim)
+            meta = index.get(os.path.basename(fim), {})
+            if meta.get('mtime') != stat.st_mtime_ns or meta.get('size') != stat.st_size:
+                meta = index[os.path.basename(fim)] = _nii_meta(fim, stat)
+                changed = True
+            res[fim] = meta
+        if changed and save:
+            try:
+                fd, ftmp = mkstemp(suffix=".json", dir=dname or None)
+            except OSError as exc:
+                log.debug("cannot save:%s:%s", findex, exc)
+                continue
+            try:
+                with os.fdopen(fd, "w") as fo:
+                    json.dump(index, fo)
+                os.replace(ftmp, findex) # atomic
+            except OSError as exc:
+                log.debug("cannot save:%s:%s", findex, exc)
+                os.remove(ftmp)
+    return {fim: res[fim] for fim in fims}
+
+
+def _read_reoriented(dataobj, trnsp, flip, key=()):
+    """
+    `_reorient(np.squeeze(np.asanyarray(dataobj)), trnsp, flip)[key]`,
+    only reading the requested region of `dataobj` if `key` is a tuple of
+    ints & slices (in reoriented coordinates).
+    """
+    if not isinstance(key, tuple):
+        key = (key,)
+    shape = dataobj.shape
+    # non-singleton on-disk axes
+    keep = [i for i, n in enumerate(shape) if n != 1]
+    if (not key or keep[:3] != [0, 1, 2] or len(keep) not in (3, 4) or len(key) > len(keep)
+            or not all(isinstance(k, (slice, numbers.Integral)) for k in key)):
+        return _reorient(np.squeeze(np.asanyarray(dataobj)), trnsp, flip)[key]
+    # reoriented axis -> on-disk axis
+    axes = list(trnsp) if len(keep) == 3 else keep[3:] + list(trnsp)
+    key += (slice(None),) * (len(axes) - len(key))
+    # on-disk index (dropping singleton axes)
+    raw = [0] * len(shape)
+    # index into the (ascending on-disk) region read
+    post = []
+    for ax, k in zip(axes, key):
+        n = shape[ax]
+        rng = range(n)[k] if isinstance(k, slice) else range(n)[k:k + 1 or None]
+        if isinstance(k, numbers.Integral) and not rng:
+            raise IndexError(f"index {k} is out of bounds for size {n}")
+        # on-disk order is reversed by `_reorient`
+        if ax < 3 and flip[ax] == 1:
+            rng = range(n - 1 - rng.start, n - 1 - rng.stop, -rng.step)
+        if not rng: # read one voxel (for the dtype) and discard it
+            raw[ax] = slice(0, 1)
+            post.append(slice(0, 0))
+            continue
+        raw[ax] = slice(min(rng), max(rng) + 1, abs(rng.step))
+        if isinstance(k, numbers.Integral):
+            post.append(0)
+        else:
+            post.append(slice(None, None, 1 if rng.step > 0 else -1))
+    imr = np.asanyarray(dataobj[tuple(raw)])
+    imr = imr.transpose([keep.index(ax) for ax in axes])
+    return imr[tuple(post)]
+
+
+def _nii_key(shape, roi=None, frames=None):
+    """`getnii` (`roi`, `frames`) -> index into the reoriented image"""
+    if roi is None and frames is None:
+        return ()
+    roi = () if roi is None else roi if isinstance(roi, tuple) else (roi,)
+    if sum(n != 1 for n in shape) == 4:
+        return (slice(None) if frames is None else frames,) + roi
+    if frames is not None:
+        raise IndexError("`frames` requires a 4D image")
+    return roi
+
+
+def getnii(fim, nan_replace=None, output='image', copy=None, roi=None, frames=None):
     """
     Get image from NIfTI file.
     Arguments:
@@ -64,30 +369,48 @@ def getnii(fim, nan_replace=None, output='image'):
                      by default no change (None).
         output: option for choosing output: image, affine matrix or
                 a dictionary with all info.
+        copy: whether the output image owns its (C-contiguous) data.
+              None (default): use memory-mapped views where possible.
+              False: the output is guaranteed to be a (flipped/transposed)
+                     view of the memory-mapped file, i.e.
+                     `np.shares_memory(im, np.asanyarray(nim.dataobj))`,
+                     except if NaNs had to be replaced (copy-on-write).
+                     Raises `ValueError` for compressed or scaled data.
+        roi: region of interest: (tuple of) int(s) or slice(s) over the
+             spatial axes of the output image (i.e. after orientation).
+             Unless `copy=False`, only the region is read from file.
+        frames: int or slice over the output time axis (4D images only).
     Return:
         'image': outputs just an image (4D or 3D)
         'affine': outputs just the affine matrix
         'all': outputs all as a dictionary
     """
+    if output == 'affine':
+        return nii_header(fim).get_best_affine()
+
     nim = nib.load(fspath(fim))
 
     dim = nim.header.get('dim')
-    dimno = dim[0]
 
     if output == 'image' or output == 'all':
-        imr = np.asanyarray(nim.dataobj)
+        trnsp, flip = _orientation(nim.affine)
+        key = _nii_key(nim.shape, roi=roi, frames=frames)
+        if copy is False:
+            imr = np.asanyarray(nim.dataobj)
+            if not isinstance(imr, np.memmap):
+                raise ValueError(f"cannot memory-map (compressed or scaled?): {fspath(fim)}")
+            imr = _reorient(np.squeeze(imr), trnsp, flip)[key]
+        else:
+            imr = _read_reoriented(nim.dataobj, trnsp, flip, key)
+
         # replace NaNs if requested
         if isinstance(nan_replace, numbers.Number):
-            imr[np.isnan(imr)] = nan_replace
-
-        imr = np.squeeze(imr)
-        if dimno != imr.ndim and dimno == 4:
-            dimno = imr.ndim
-
-        # > get orientations from the affine
-        ornt = nib.io_orientation(nim.affine)
-        trnsp = tuple(np.flip(np.argsort(ornt[:, 0])))
-        flip = tuple(np.int8(ornt[:, 1]))
+            nans = np.isnan(imr)
+            if nans.any():
+                # memory-maps are copy-on-write (mode 'c'), so only touched pages are copied
+                if not imr.flags.writeable:
+                    imr = np.array(imr)
+                imr[nans] = nan_replace
 
         # > voxel size
         voxsize = nim.header.get('pixdim')[1:nim.header.get('dim')[0] + 1]
@@ -98,11 +421,8 @@ def getnii(fim, nan_replace=None, output='image'):
         dims = dim[1:nim.header.get('dim')[0] + 1]
         dims = dims[np.array(trnsp)]
 
-        # > flip y-axis and z-axis and then transpose
-        if dimno == 4:   # dynamic
-            imr = np.transpose(imr[::-flip[0], ::-flip[1], ::-flip[2], :], (3,) + trnsp)
-        elif dimno == 3: # static
-            imr = np.transpose(imr[::-flip[0], ::-flip[1], ::-flip[2]], trnsp)
+        if copy:
+            imr = np.array(imr, order='C')
 
     if output == 'affine' or output == 'all':
         # A = nim.get_sform()
@@ -124,22 +444,27 @@ def getnii(fim, nan_replace=None, output='image'):
     return out
 
 
-def array2nii(im, A, fnii, descrip="", trnsp=None, flip=None, storage_as=None):
+def _nib_save(nim, fnii, threads=None):
     """
-    Store the numpy array 'im' to a NIfTI file 'fnii'.
-    Arguments:
-        'im':       image to be stored in NIfTI
-        'A':        affine transformation
-        'fnii':     output NIfTI file name.
-        'descrip':  the description given to the file
-        'trsnp':    transpose/permute the dimensions.
-                    In NIfTI it has to be in this order: [x,y,z,t,...])
-        'flip':     flip tuple for flipping the direction of x,y,z axes.
-                    (1: no flip, -1: flip)
-        'storage_as': uses the flip and displacement as given by the following
-                    NifTI dictionary, obtained using
-                    `getnii(filepath, output='all')`.
+    `nib.save`, using `threads` (as per `nii_gzip`) to compress `*.gz`
+    on-the-fly (without temporary files)
     """
+    fnii = fspath(fnii)
+    threads = _gzip_threads(threads)
+    if threads < 2 or not hasext(fnii, "gz"):
+        return nib.save(nim, fnii)
+    try:
+        # same compression level as nibabel
+        with open(fnii, "wb") as fo, _GzipBlockWriter(fo, threads, compresslevel=1) as fz:
+            nim.to_stream(fz)
+    except (Exception, KeyboardInterrupt):
+        if os.path.exists(fnii):
+            os.remove(fnii)
+        raise
+
+
+def _storage_order(trnsp=None, flip=None, storage_as=None):
+    """`array2nii` (`trnsp`, `flip`, `storage_as`) -> (`trnsp`, `flip`)"""
     trnsp = trnsp or ()
     flip = flip or ()
     storage_as = storage_as or []
@@ -160,6 +485,183 @@ def array2nii(im, A, fnii, descrip="", trnsp=None, flip=None, storage_as=None):
 
         flip = storage_as['flip']
 
+    return trnsp, flip
+
+
+def _frame2nii(im, trnsp, flip):
+    """3D `im` -> NIfTI [x,y,z] order (a view) as per `array2nii`"""
+    im = im.transpose(trnsp or None)
+    if len(flip) == 3:
+        im = im[::-flip[0], ::-flip[1], ::-flip[2]]
+    return im
+
+
+def _nii_hdr(A, shape, dtype, descrip=""):
+    """NIfTI-1 header as per `array2nii` (excluding `cal_min`/`cal_max`)"""
+    hdr = nib.Nifti1Header()
+    hdr.set_data_dtype(dtype)
+    hdr.set_data_shape(shape)
+    # as per `nib.Nifti1Image`
+    hdr.set_sform(A, code='aligned')
+    hdr.set_qform(A, code='unknown')
+    # as per `array2nii`
+    hdr.set_sform(None, code='scanner')
+    hdr['descrip'] = descrip
+    return hdr
+
+
+class Nifti4DWriter(object):
+    """
+    Write a 4D (dynamic) NIfTI file one 3D frame at a time, directly into a
+    (preallocated if `nframes` is given) file. `cal_min`/`cal_max` are
+    computed along the way.
+
+    >>> geom = getnii(fim, output='all')
+    >>> with Nifti4DWriter("dynamic.nii.gz", geom['affine'], storage_as=geom) as nii:
+    ...     for frame in frames:
+    ...         nii.append(frame)
+    """
+    def __init__(self, fnii, A, nframes=None, descrip="", trnsp=None, flip=None, storage_as=None,
+                 dtype=None, threads=None):
+        """
+        Args:
+          fnii (path): output `*.nii` or `*.nii.gz` file. The latter is
+            compressed on-the-fly (using nibabel's default level), with the
+            header in a fixed-size (uncompressed) gzip member rewritten on
+            `close()`.
+          A: affine transformation.
+          nframes (int): expected number of frames (used to preallocate).
+          dtype: output data type (default: that of the first frame).
+          descrip, trnsp, flip, storage_as, threads: as per `array2nii`.
+        """
+        self.fnii = fspath(fnii)
+        self.affine = A
+        self.nframes = nframes
+        self.descrip = descrip
+        self.trnsp, self.flip = _storage_order(trnsp, flip, storage_as)
+        self.dtype = dtype
+        self.threads = threads
+        self.hdr = None
+        self.n = 0
+        self.cal_min, self.cal_max = np.inf, -np.inf
+        self._fd = open(self.fnii, "wb")
+        # compressed data stream (`*.gz`)
+        self._gz = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()
+
+    def append(self, im):
+        """Write the next 3D frame, given as per `array2nii(im=frame, ...)`"""
+        im = _frame2nii(np.asanyarray(im), self.trnsp, self.flip)
+        if self.hdr is None:
+            shape = im.shape + (self.nframes or 1,)
+            self.hdr = _nii_hdr(self.affine, shape, self.dtype or im.dtype, descrip=self.descrip)
+            # placeholder (finalised by `close()`)
+            if hasext(self.fnii, "gz"):
+                self._fd.write(self._header_member())
+                self._gz = _GzipBlockWriter(self._fd, _gzip_threads(self.threads), compresslevel=1)
+            else:
+                self.hdr.write_to(self._fd)
+                if self.nframes:
+                    self._fd.truncate(self.hdr.get_data_offset() +
+                                      self.nframes * im.size * self.hdr.get_data_dtype().itemsize)
+        elif im.shape != self.hdr.get_data_shape()[:3]:
+            raise ValueError(f"frame shape {im.shape} != {self.hdr.get_data_shape()[:3]}")
+        if self.nframes is not None and self.n >= self.nframes:
+            raise IndexError(f"more than nframes={self.nframes}")
+        im = np.asarray(im, dtype=self.hdr.get_data_dtype())
+        lo, hi = _minmax(im)
+        # NaN-propagating (as per `array2nii`)
+        self.cal_min, self.cal_max = np.minimum(self.cal_min, lo), np.maximum(self.cal_max, hi)
+        (self._gz or self._fd).write(im.tobytes(order='F'))
+        self.n += 1
+
+    def _header_member(self):
+        """`self.hdr` (padded to the data offset) as a stored gzip member"""
+        raw = BytesIO()
+        self.hdr.write_to(raw)
+        raw = raw.getvalue().ljust(self.hdr.get_data_offset(), b"\0")
+        # fixed size for a given input size
+        return gzip.compress(raw, compresslevel=0, mtime=0)
+
+    def close(self):
+        """Finalise the header (and compressed stream if needed)"""
+        if self._fd.closed:
+            return
+        if self.hdr is None:
+            self._abort()
+            raise ValueError("no frames")
+        try:
+            self.hdr.set_data_shape(self.hdr.get_data_shape()[:3] + (self.n,))
+            self.hdr['cal_min'], self.hdr['cal_max'] = self.cal_min, self.cal_max
+            if self._gz is not None:
+                self._gz.close()
+                self._fd.seek(0)
+                self._fd.write(self._header_member())
+            else:
+                self._fd.truncate() # in case of fewer than `nframes`
+                self._fd.seek(0)
+                self.hdr.write_to(self._fd)
+            self._fd.close()
+        except (Exception, KeyboardInterrupt):
+            self._abort()
+            raise
+
+    def _abort(self):
+        """Close and remove output"""
+        if self._gz is not None:
+            self._gz.discard()
+        self._fd.close()
+        if os.path.exists(self.fnii):
+            os.remove(self.fnii)
+
+
+def frames2nii(frames, A, fnii, descrip="", trnsp=None, flip=None, storage_as=None, dtype=None,
+               threads=None):
+    """
+    Out-of-core `array2nii` for 4D (dynamic) images, writing one 3D frame at
+    a time (using `Nifti4DWriter`) so that peak memory is about one frame.
+    Arguments:
+        'frames':   iterable of 3D frames (e.g. a 4D `np.memmap`, `LazyNii4D`,
+                    or a generator), each as per `array2nii(im=frame, ...)`.
+        'dtype':    output data type (default: that of the first frame).
+        (others):   as per `array2nii`.
+    """
+    nframes = len(frames) if hasattr(frames, "__len__") else None
+    with Nifti4DWriter(fnii, A, nframes=nframes, descrip=descrip, trnsp=trnsp, flip=flip,
+                       storage_as=storage_as, dtype=dtype, threads=threads) as nii:
+        for im in frames:
+            nii.append(im)
+
+
+def array2nii(im, A, fnii, descrip="", trnsp=None, flip=None, storage_as=None, threads=None,
+              cal_range=None):
+    """
+    Store the numpy array 'im' to a NIfTI file 'fnii'.
+    Arguments:
+        'im':       image to be stored in NIfTI
+        'A':        affine transformation
+        'fnii':     output NIfTI file name.
+        'descrip':  the description given to the file
+        'trsnp':    transpose/permute the dimensions.
+                    In NIfTI it has to be in this order: [x,y,z,t,...])
+        'flip':     flip tuple for flipping the direction of x,y,z axes.
+                    (1: no flip, -1: flip)
+        'storage_as': uses the flip and displacement as given by the following
+                    NifTI dictionary, obtained using
+                    `getnii(filepath, output='all')`.
+        'threads':  number of threads to compress `*.gz` output (see `nii_gzip`).
+        'cal_range': (cal_min, cal_max) if known (default: computed from `im`).
+    """
+    trnsp, flip = _storage_order(trnsp, flip, storage_as)
+
     if not trnsp:
         im = im.transpose()
     # > check if the image is 4D (dynamic) and modify as needed
@@ -176,20 +678,133 @@ def array2nii(im, A, fnii, descrip="", trnsp=None, flip=None, storage_as=None):
     res = nib.Nifti1Image(im, A, dtype=im.dtype)
     hdr = res.header
     hdr.set_sform(None, code='scanner')
-    hdr['cal_max'] = np.max(im) # np.percentile(im, 90) #
-    hdr['cal_min'] = np.min(im)
+    if cal_range is None:
+        cal_range = _minmax(im)
+    hdr['cal_min'], hdr['cal_max'] = cal_range
     hdr['descrip'] = descrip
-    nib.save(res, fspath(fnii))
+    _nib_save(res, fnii, threads=threads)
+
+
+def _pmap(fn, items, n_jobs=None, processes=False):
+    """
+    `list(map(fn, items))`, optionally over a pool of `n_jobs` workers
+    (threads, or `processes`). `n_jobs < 0` uses all CPUs.
+    """
+    items = list(items)
+    if not n_jobs or n_jobs == 1 or len(items) < 2:
+        return list(map(fn, items))
+    Pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with Pool(max_workers=None if n_jobs < 0 else n_jobs) as pool:
+        return list(pool.map(fn, items))
+
+
+def _nii_frame(nim):
+    """Reoriented 3D image from a loaded NIfTI (as per `getnii`)"""
+    return np.asarray(_reorient(np.squeeze(np.asanyarray(nim.dataobj)), *_orientation(nim.affine)))
 
 
-def niisort(fims, memlim=True):
+def _nii_load(fim, frame=False):
+    """-> (NIfTI image, `_nii_frame` if `frame` else None)"""
+    nim = nib.load(fspath(fim))
+    return nim, (_nii_frame(nim) if frame else None)
+
+
+class LazyNii4D(object):
+    """
+    Read-only 4D (frames, z, y, x) array-like over a list of 3D NIfTI files.
+
+    Frames are only read on indexing, through nibabel's (memory-mapped where
+    possible) `dataobj`, and reoriented as per `getnii` (`flip` then
+    `transpose`). Missing frames (`None` or "Blank" file names) read as zeros.
+    Use `np.asarray(...)` to load everything.
+    """
+    def __init__(self, files, shape, dtype, flip, trnsp):
+        """
+        Args:
+          files (list): frame file names (`None` or "Blank" for missing frames).
+          shape (tuple): reoriented 3D frame shape.
+          dtype: output data type.
+          flip (tuple): as per `getnii(..., output='all')['flip']`.
+          trnsp (tuple): as per `getnii(..., output='all')['transpose']`.
+        """
+        self.files = list(files)
+        self.shape = (len(self.files),) + tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.flip = tuple(flip)
+        self.transpose = tuple(trnsp)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return "{}(shape={}, dtype={})".format(type(self).__name__, self.shape, self.dtype)
+
+    def frame(self, i, key=()):
+        """
+        Reoriented frame `i`, indexed by `key` (only reading the required
+        region from file). Otherwise a view of a `np.memmap` if possible.
+        """
+        fim = self.files[i]
+        if fim is None or fim == "Blank":
+            return np.zeros(self.shape[1:], dtype=self.dtype)[key]
+        return _read_reoriented(nib.load(fspath(fim)).dataobj, self.transpose, self.flip, key)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if key and key[0] is Ellipsis:
+            if len(key) - 1 >= self.ndim:
+                key = key[1:]
+            else:
+                key = (slice(None),) + key
+        frames, rest = (key[0], key[1:]) if key else (slice(None), ())
+        if isinstance(frames, numbers.Integral):
+            return np.asarray(self.frame(range(len(self))[frames], rest), dtype=self.dtype)
+        idx = np.arange(len(self))[frames]
+        res = None
+        for j, i in enumerate(idx):
+            im = self.frame(i, rest)
+            if res is None:
+                res = np.empty((len(idx),) + np.shape(im), dtype=self.dtype)
+            res[j] = im
+        if res is None: # no frames selected
+            res = np.zeros((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + rest]
+        return res
+
+    def __array__(self, dtype=None, copy=None):
+        res = self[:]
+        return res if dtype is None else res.astype(dtype, copy=False)
+
+
+def niisort(fims, memlim=True, lazy=False, n_jobs=None, processes=False, single_pass=False,
+            index=False):
     """
     Sort all input NIfTI images and check their shape.
     Output dictionary of image files and their properties.
     Options:
         memlim -- when processing large numbers of frames the memory may
-        not be large enough.  memlim causes that the output does not contain
-        all the arrays corresponding to the images.
+        not be large enough.  memlim causes that the output 'im' is a
+        `LazyNii4D` (frames read on demand) for more than 50 frames.
+        lazy -- always output 'im' as a `LazyNii4D`.
+        n_jobs -- number of workers (threads, or `processes`) used to read
+        headers and frames (default: serial, -1: all CPUs).
+        single_pass -- read each frame in the same pass as its header
+        (wasted work if the input shapes/types turn out to be inconsistent).
+        Otherwise frames are read in a second pass (reusing the headers).
+        index -- read header information from (and update) `nii_index`
+        instead of loading each image (ignores `single_pass`).
     """
     # number of NIfTI images in folder
     Nim = 0
@@ -223,53 +838,55 @@ def niisort(fims, memlim=True):
 
     # number of frames (can be larger than the # images)
     Nfrm = max(sortlist) + 1
+    lazy = lazy or (memlim and Nfrm > 50)
     # sort the list according to the frame numbers
     _fims = ["Blank"] * Nfrm
-    # list of NIfTI image shapes and data types used
-    shape = []
-    datype = []
-    _nii = []
     for i in range(Nim):
-        if dyn_flg:
-            _fims[sortlist[i]] = fims[i]
-            _nii = nib.load(fims[i])
-            datype.append(_nii.get_data_dtype())
-            shape.append(_nii.shape)
-        else:
-            _fims[i] = fims[i]
-            _nii = nib.load(fims[i])
-            datype.append(_nii.get_data_dtype())
-            shape.append(_nii.shape)
+        _fims[sortlist[i] if dyn_flg else i] = fims[i]
+    if index:
+        _niis = [(None, None)] * Nim
+        hdrs = [(tuple(m['shape']), np.dtype(m['dtype']), np.array(m['affine']))
+                for m in nii_index(fims[:Nim]).values()]
+    else:
+        # NIfTI images (and frames if `single_pass`) in input order
+        _niis = _pmap(partial(_nii_load, frame=single_pass and not lazy), fims[:Nim],
+                      n_jobs=n_jobs, processes=processes)
+        hdrs = [(nim.shape, nim.get_data_dtype(), nim.affine) for nim, _ in _niis]
+    # list of NIfTI image shapes and data types used
+    shape = [i[0] for i in hdrs]
+    datype = [i[1] for i in hdrs]
+    _shape, _dtype, affine = hdrs[-1]
 
     # check if all images are of the same shape and data type
-    if _nii and shape.count(_nii.shape) != len(shape):
+    if shape.count(_shape) != len(shape):
         raise ValueError("Input images are of different shapes.")
-    if _nii and datype.count(_nii.get_data_dtype()) != len(datype):
+    if datype.count(_dtype) != len(datype):
         raise TypeError("Input images are of different data types.")
     # image shape must be 3D
-    if _nii and len(_nii.shape) != 3:
+    if len(_shape) != 3:
         raise ValueError("Input image(s) must be 3D.")
 
-    out = {
-        'shape': _nii.shape[::-1], 'files': _fims, 'sortlist': sortlist,
-        'dtype': _nii.get_data_dtype(), 'N': Nim}
+    out = {'shape': _shape[::-1], 'files': _fims, 'sortlist': sortlist, 'dtype': _dtype, 'N': Nim}
 
-    if memlim and Nfrm > 50:
-        imdic = getnii(_fims[0], output='all')
-        affine = imdic['affine']
-        flip = imdic['flip']
-        trnsp = imdic['transpose']
+    trnsp, flip = _orientation(affine)
+    # reoriented shape (as per `getnii`)
+    shape = tuple(np.array(_shape)[np.array(trnsp)])
+    if lazy:
+        out['im'] = LazyNii4D(_fims, shape, _dtype, flip, trnsp)
     else:
         # get the images into an array
-        _imin = np.zeros((Nfrm,) + _nii.shape[::-1], dtype=_nii.get_data_dtype())
-        for i in range(Nfrm):
-            if i in sortlist:
-                imdic = getnii(_fims[i], output='all')
-                _imin[i, :, :, :] = imdic['im']
-                affine = imdic['affine']
-                flip = imdic['flip']
-                trnsp = imdic['transpose']
-        out['im'] = _imin[:Nfrm, :, :, :]
+        _imin = np.zeros((Nfrm,) + shape, dtype=_dtype)
+        if single_pass and not index:
+            ims = [im for _, im in _niis]
+        elif index:
+            _niis = _pmap(partial(_nii_load, frame=True), fims[:Nim], n_jobs=n_jobs,
+                          processes=processes)
+            ims = [im for _, im in _niis]
+        else:
+            ims = _pmap(_nii_frame, [nim for nim, _ in _niis], n_jobs=n_jobs, processes=processes)
+        for i, im in enumerate(ims):
+            _imin[sortlist[i] if dyn_flg else i] = im
+        out['im'] = _imin
 
     out['affine'] = affine
     out['flip'] = flip
@@ -278,21 +895,65 @@ def niisort(fims, memlim=True):
     return out
 
 
-def nii_modify(nii_fd, fimout="", outpath="", fcomment="", voxel_range=None):
+def _minmax(im, chunk_size=2**20):
+    """(min, max) of `im` in a single pass (`chunk_size` elements at a time)"""
+    lo = hi = None
+    for x in np.nditer(np.asanyarray(im), flags=["external_loop", "buffered"],
+                       buffersize=chunk_size):
+        lo = x.min() if lo is None else np.minimum(lo, x.min())
+        hi = x.max() if hi is None else np.maximum(hi, x.max())
+    return lo, hi
+
+
+def _rescale(im, scale, shift=0, offset=0, out=None, out_dtype=None, chunk_size=2**20):
+    """
+    `(im - shift) * scale + offset`, computed `chunk_size` elements at a time into
+    `out` (may be `im`) or a new array of `out_dtype` (rounded if integer).
+    Returns (out, min(out), max(out)).
+    """
+    if out is None:
+        out = np.empty(im.shape, dtype=out_dtype or im.dtype)
+    work = out.dtype if out.dtype.kind == 'f' else np.float64
+    if out is im:
+        ops, op_flags = [im], [["readwrite"]]
+    else:
+        ops, op_flags = [im, out], [["readonly"], ["writeonly"]]
+    lo = hi = None
+    with np.nditer(ops, flags=["external_loop", "buffered"], op_flags=op_flags,
+                   op_dtypes=[work] * len(ops), casting="unsafe", buffersize=chunk_size) as it:
+        for x in it:
+            x, y = (x, x) if out is im else x
+            np.subtract(x, shift, out=y)
+            np.multiply(y, scale, out=y)
+            np.add(y, offset, out=y)
+            if out.dtype.kind != 'f':
+                np.rint(y, out=y)
+            lo = y.min() if lo is None else np.minimum(lo, y.min())
+            hi = y.max() if hi is None else np.maximum(hi, y.max())
+    return out, lo, hi
+
+
+def nii_modify(nii_fd, fimout="", outpath="", fcomment="", voxel_range=None, out_dtype=None,
+               inplace=False):
     """
     Modify the NIfTI image given either as a file path or a dictionary,
     obtained by `getnii(file_path)`.
 
     @param nii_fd  : file or dict
+    @param out_dtype  : output data type (default: input if floating, otherwise float64).
+                        Integer outputs are rounded.
+    @param inplace  : overwrite `nii_fd["im"]` (requires `out_dtype` to match).
     """
     voxel_range = voxel_range or []
+    if not isinstance(nii_fd, dict):
+        nii_fd = fspath(nii_fd)
     if isinstance(nii_fd, string_types) and os.path.isfile(nii_fd):
         dctnii = getnii(nii_fd, output="all")
         fnii = nii_fd
     if isinstance(nii_fd, dict) and "im" in nii_fd:
         dctnii = nii_fd
         if "fim" in dctnii:
-            fnii = dctnii["fim"]
+            fnii = fspath(dctnii["fim"])
 
     if not outpath and fimout and "/" in fimout:
         opth = os.path.dirname(fimout)
@@ -315,13 +976,20 @@ def nii_modify(nii_fd, fimout="", outpath="", fcomment="", voxel_range=None):
     log.debug("output floating and affine file names:%s", fout)
     fout = os.path.join(opth, fout)
 
-    if len(voxel_range) == 1:                                               # set max value
-        im = voxel_range[0] * dctnii["im"] / np.max(dctnii["im"])
-    elif len(voxel_range) == 2:                                             # set range
-        im = (dctnii["im"] - np.min(dctnii["im"])) * (np.ptp(voxel_range) /
-                                                      np.ptp(dctnii["im"])) + voxel_range[0]
+    im = dctnii["im"]
+    if len(voxel_range) == 1:                                              # set max value
+        shift, scale, offset = 0, np.float64(voxel_range[0]) / _minmax(im)[1], 0
+    elif len(voxel_range) == 2:                                            # set range
+        lo, hi = map(float, _minmax(im))
+        shift, scale, offset = lo, np.ptp(voxel_range) / (hi-lo), voxel_range[0]
     else:
         return None
+    if out_dtype is None:
+        out_dtype = im.dtype if im.dtype.kind == 'f' else np.float64
+    if inplace and np.dtype(out_dtype) != im.dtype:
+        raise TypeError(f"inplace requires out_dtype ({out_dtype}) == {im.dtype}")
+    im, cal_min, cal_max = _rescale(im, scale, shift=shift, offset=offset,
+                                    out=im if inplace else None, out_dtype=out_dtype)
 
     # > output file name for the extra reference image
     array2nii(
@@ -334,6 +1002,22 @@ def nii_modify(nii_fd, fimout="", outpath="", fcomment="", voxel_range=None):
             dctnii["transpose"].index(2),
         ),
         flip=dctnii["flip"],
+        cal_range=(cal_min, cal_max),
     )
 
     return {"fim": fout, "im": im, "affine": dctnii["affine"]}
+
+
+def nii_modify_batch(fims, n_jobs=-1, processes=False, **kwargs):
+    """
+    `nii_modify(fim, **kwargs)` for each of `fims` over a pool of `n_jobs`
+    workers (threads, or `processes`). Returns output file names.
+    """
+    return _pmap(partial(_nii_modify_fim, **kwargs), map(fspath, fims), n_jobs=n_jobs,
+                 processes=processes)
+
+
+def _nii_modify_fim(fim, **kwargs):
+    """`nii_modify(...)['fim']`"""
+    res = nii_modify(fim, **kwargs)
+    return res and res["fim"]
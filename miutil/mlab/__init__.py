@@ -1,27 +1,37 @@
+import json
 import logging
 import os
 import re
 import sys
 from ast import literal_eval
+from contextlib import contextmanager
 from functools import lru_cache
 from os import getenv, path
 from platform import system
+from queue import Empty, Queue
+from shutil import which
 from subprocess import STDOUT, CalledProcessError, check_output
+from tempfile import mkstemp
 from textwrap import dedent
+from time import time
 
 try:
     FileNotFoundError
 except NameError:
     FileNotFoundError = OSError
 
-from ..fdio import Path, extractall, fspath, tmpdir
+from ..fdio import Path, extractall, file_lock, fspath, get_cache_dir, tmpdir
 
-__all__ = ["get_engine"]
+__all__ = ["get_engine", "EnginePool"]
 IS_WIN = any(sys.platform.startswith(i) for i in ["win32", "cygwin"])
 MATLAB_RUN = "matlab -nodesktop -nosplash -nojvm".split()
 if IS_WIN:
     MATLAB_RUN += ["-wait", "-log"]
 log = logging.getLogger(__name__)
+# discovery cache (in `~/.miutil`)
+MATLAB_CACHE = "matlab.json"
+# seconds before retrying a failed `_install_engine`
+ENGINE_RETRY = 3600
 _MCR_URL = {
     99: ("https://ssd.mathworks.com/supportfiles/downloads/R2020b/Release/4"
          "/deployment_files/installer/complete/"),
@@ -54,8 +64,8 @@ def env_prefix(key, dir):
         os.environ[key] = fspath(dir)
 
 
-@lru_cache()
-def get_engine(name=None):
+def _engine_module():
+    """`matlab.engine`, installing it if need be"""
     try:
         from matlab import engine
     except ImportError:
@@ -89,6 +99,12 @@ install-matlab-engine-api-for-python-in-nondefault-locations.html
                 """).format(
                     setup_dir=path.join(matlabroot(default="matlabroot"), "extern", "engines",
                                         "python"), exe=sys.executable, pre=sys.prefix))
+    return engine
+
+
+@lru_cache()
+def get_engine(name=None):
+    engine = _engine_module()
     log.debug("Starting MATLAB")
     try:
         eng = engine.connect_matlab(name=name or getenv("SPM12_MATLAB_ENGINE", None))
@@ -99,6 +115,153 @@ install-matlab-engine-api-for-python-in-nondefault-locations.html
     return eng
 
 
+class EnginePool(object):
+    """
+    Thread-safe pool of `size` warm MATLAB engines.
+
+    >>> with EnginePool(4) as pool:
+    ...     res = list(pool.map(lambda eng, x: eng.sqrt(x), [1.0, 4.0, 9.0]))
+
+    Args:
+      size (int): number of engines (default: `os.cpu_count()`).
+      factory (callable): returns a new engine
+        (default: `matlab.engine.start_matlab`).
+      init (callable): optional `init(engine)`, e.g. to `addpath`.
+      check (callable): `check(engine)` should raise if unhealthy
+        (default: `engine.eval("1;")`). Used on checkout. `False` to skip.
+      errors (tuple): exception types which require an engine restart
+        (default: `(matlab.engine.EngineError,)`).
+    """
+    def __init__(self, size=None, factory=None, init=None, check=None, errors=None):
+        self.size = size or os.cpu_count() or 1
+        if factory is None or errors is None:
+            engine = _engine_module()
+            factory = factory or engine.start_matlab
+            errors = (engine.EngineError,) if errors is None else errors
+        self.factory = factory
+        self.init = init
+        self.check = (lambda eng: eng.eval("1;", nargout=0)) if check is None else check
+        self.errors = tuple(errors)
+        self.engines = Queue()
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(self.size) as pool:
+            futures = [pool.submit(self._start) for _ in range(self.size)]
+        errors = [i.exception() for i in futures if i.exception() is not None]
+        if errors:
+            # don't leak the engines which did start
+            for i in futures:
+                if i.exception() is None:
+                    self._quit(i.result())
+            raise errors[0]
+        for i in futures:
+            self.engines.put(i.result())
+
+    def _start(self):
+        log.debug("Starting MATLAB")
+        eng = self.factory()
+        if self.init is not None:
+            try:
+                self.init(eng)
+            except BaseException:
+                self._quit(eng)
+                raise
+        return eng
+
+    def _healthy(self, eng):
+        if not self.check:
+            return True
+        try:
+            self.check(eng)
+        except Exception as exc:
+            log.warning("unhealthy MATLAB engine:%s", exc)
+            return False
+        return True
+
+    @staticmethod
+    def _quit(eng):
+        try:
+            eng.quit()
+        except Exception as exc:
+            log.debug("quit:%s", exc)
+
+    def checkout(self, timeout=None):
+        """
+        Take a healthy engine from the pool (blocking up to `timeout` seconds),
+        restarting it if need be. Must be returned via `checkin`.
+        Raises:
+          queue.Empty: on timeout.
+        """
+        eng = self.engines.get(timeout=timeout)
+        if eng is None or not self._healthy(eng):
+            if eng is not None:
+                self._quit(eng)
+            try:
+                eng = self._start()
+            except BaseException:
+                self.engines.put(None)
+                raise
+        return eng
+
+    def checkin(self, eng, restart=False):
+        """Return `eng` to the pool, marking it for a (lazy) `restart`"""
+        if restart:
+            self._quit(eng)
+            eng = None
+        self.engines.put(eng)
+
+    @contextmanager
+    def engine(self, timeout=None):
+        """`checkout` context, restarting the engine on any of `self.errors`"""
+        eng = self.checkout(timeout=timeout)
+        try:
+            yield eng
+        except self.errors:
+            log.warning("restarting MATLAB engine")
+            self.checkin(eng, restart=True)
+            raise
+        except BaseException:
+            self.checkin(eng)
+            raise
+        self.checkin(eng)
+
+    def map(self, fn, items, retries=1):
+        """
+        Lazily (in order) yields `fn(engine, item)` for `item` in `items`,
+        concurrently over the pool. Items raising any of `self.errors`
+        are retried (up to `retries` times) on a restarted engine.
+        """
+        def run(item):
+            for attempt in range(retries, -1, -1):
+                try:
+                    with self.engine() as eng:
+                        return fn(eng, item)
+                except self.errors:
+                    if not attempt:
+                        raise
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(self.size) as pool:
+            yield from pool.map(run, items)
+
+    def close(self):
+        """Quit all checked-in engines"""
+        while True:
+            try:
+                eng = self.engines.get_nowait()
+            except Empty:
+                break
+            if eng is not None:
+                self._quit(eng)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
 def _matlab_run(command, jvm=False, auto_exit=True):
     if auto_exit and not command.endswith("exit"):
         command = command + ", exit"
@@ -106,37 +269,103 @@ def _matlab_run(command, jvm=False, auto_exit=True):
                            stderr=STDOUT)
 
 
-def matlabroot(default=None):
-    if IS_WIN:
+def _matlab_cache(**update):
+    """
+    Persistent (`~/.miutil/matlab.json`) discovery results for the `matlab`
+    executable on `PATH`, invalidated by its path & modification time.
+    Keys: `root`, `version`, `python` (supported versions),
+    `engine` (`{sys.executable: time of last failed install}`).
+
+    Args:
+      **update: new values to save. `dict` values are merged into
+        existing ones (with `None` removing an entry).
+    Returns:
+      dict: cached (& updated) results
+    """
+    exe = which("matlab")
+    if not exe:
+        return update
+    exe = path.realpath(exe)
+    mtime = path.getmtime(exe)
+    fcache = path.join(get_cache_dir(), MATLAB_CACHE)
+
+    def load():
         try:
-            res = _matlab_run("display(matlabroot);")
-        except (CalledProcessError, FileNotFoundError):
-            if default:
-                return default
-            raise
-        return re.search(r"^([A-Z]:\\.*)\s*$", res, flags=re.M).group(1)
+            with open(fcache) as fd:
+                cache = json.load(fd)
+        except (IOError, ValueError):
+            cache = {}
+        info = cache.get(exe, {})
+        return cache, (info if info.get("mtime") == mtime else {"mtime": mtime})
+
+    if not update:
+        return load()[1]
+    with file_lock(f"{fcache}.lock"):
+        # re-read under lock to avoid losing concurrent updates
+        cache, info = load()
+        for key, val in update.items():
+            if isinstance(val, dict):
+                val = {k: v for k, v in dict(info.get(key) or {}, **val).items() if v is not None}
+            info[key] = val
+        cache[exe] = info
+        fd, tmp = mkstemp(dir=path.dirname(fcache), suffix=".tmp")
+        with os.fdopen(fd, "w") as fo:
+            json.dump(cache, fo)
+        os.replace(tmp, fcache)
+    return info
 
+
+def matlabroot(default=None):
+    root = _matlab_cache().get("root")
+    if root:
+        return root
     try:
-        res = check_output_u8(["matlab", "-n"])
+        if IS_WIN:
+            res = _matlab_run("display(matlabroot);")
+            root = re.search(r"^([A-Z]:\\.*)\s*$", res, flags=re.M).group(1)
+        else:
+            res = check_output_u8(["matlab", "-n"])
+            root = re.search(r"MATLAB\s+=\s+(\S+)\s*$", res, flags=re.M).group(1)
     except (CalledProcessError, FileNotFoundError):
         if default:
             return default
         raise
-    return re.search(r"MATLAB\s+=\s+(\S+)\s*$", res, flags=re.M).group(1)
+    _matlab_cache(root=root, version=path.basename(root).lstrip("R"))
+    return root
 
 
 def _install_engine():
+    failed = _matlab_cache().get("engine", {}).get(sys.executable)
+    if failed and time() - failed < ENGINE_RETRY:
+        fcache = path.join(get_cache_dir(), MATLAB_CACHE)
+        raise CalledProcessError(
+            1, "_install_engine",
+            output=f"failed {time() - failed:.0f}s ago (clear {fcache} to retry)")
+    try:
+        res = _install_engine_setup()
+    except CalledProcessError:
+        _matlab_cache(engine={sys.executable: time()})
+        raise
+    if failed:
+        _matlab_cache(engine={sys.executable: None})
+    return res
+
+
+def _install_engine_setup():
     src = path.join(matlabroot(), "extern", "engines", "python")
-    with open(path.join(src, "setup.py")) as fd:
-        # check version support
-        supported = literal_eval(
-            re.search(r"supported_version.*?=\s*(.*?)$", fd.read(), flags=re.M).group(1))
-        if ".".join(map(str, sys.version_info[:2])) not in map(str, supported):
-            raise VersionError(
-                dedent("""\
-                Python version is {info[0]}.{info[1]},
-                but the installed MATLAB only supports Python versions: [{supported}]
-                """.format(info=sys.version_info[:2], supported=", ".join(supported))))
+    supported = _matlab_cache().get("python")
+    if supported is None:
+        with open(path.join(src, "setup.py")) as fd:
+            supported = literal_eval(
+                re.search(r"supported_version.*?=\s*(.*?)$", fd.read(), flags=re.M).group(1))
+        _matlab_cache(python=list(supported))
+    # check version support
+    if ".".join(map(str, sys.version_info[:2])) not in map(str, supported):
+        raise VersionError(
+            dedent("""\
+            Python version is {info[0]}.{info[1]},
+            but the installed MATLAB only supports Python versions: [{supported}]
+            """.format(info=sys.version_info[:2], supported=", ".join(supported))))
     with tmpdir() as td:
         cmd = [sys.executable, "setup.py", "build", "--build-base", td, "install"]
         try:
@@ -172,9 +401,9 @@ def get_runtime(cache="~/.mcr", version=99):
 
         log.info("Downloading to %s", cache)
         with tmpdir() as td:
-            with urlopen_cached(MCR_URL[version], cache) as fd:
+            with urlopen_cached(MCR_URL[version], cache, segments=8) as fd:
                 if MCR_URL[version].endswith(".zip"):
-                    extractall(fd, td)
+                    extractall(fd, td, n_jobs=os.cpu_count())
             log.info("Installing ... (may take a few min)")
             if version == 99:
                 check_output_u8([
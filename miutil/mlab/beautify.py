@@ -1,29 +1,37 @@
 #!/usr/bin/env python
 """Usage:
-  mbeautify <mfile>...
+  mbeautify [options] <mfile>...
 
 Arguments:
   <mfile>  : Path to `*.m` file
+
+Options:
+  -j N, --jobs N  : number of concurrent MATLAB engines [default: 1:int]
+  -f, --force  : reformat files even if unchanged since the last run
 """
+import json
 import logging
 from functools import wraps
+from hashlib import sha256
 from os import path
 from zipfile import ZipFile
 
 from argopt import argopt
+from tqdm.auto import tqdm
 from tqdm.contrib import tmap
 
+from ..fdio import file_lock, get_cache_dir
 from ..web import get_file
-from . import get_engine, lru_cache
+from . import EnginePool, get_engine, lru_cache
 
 log = logging.getLogger(__name__)
 MBEAUTIFIER_REV = "6005eeb8b17be8a40be32cea73005cf0d36de4e9"
+# `{abspath: sha256}` of formatted files, in `~/.miutil`
+MBEAUTIFY_CACHE = "mbeautify.json"
 
 
-@lru_cache()
-@wraps(get_engine)
-def ensure_mbeautifier(*args, **kwargs):
-    eng = get_engine(*args, **kwargs)
+def get_mbeautifier():
+    """Download & extract MBeautifier, returning its path"""
     fn = get_file(
         f"MBeautifier-{MBEAUTIFIER_REV[:7]}.zip",
         f"https://github.com/davidvarga/MBeautifier/archive/{MBEAUTIFIER_REV}.zip",
@@ -33,23 +41,69 @@ def ensure_mbeautifier(*args, **kwargs):
         with ZipFile(fn) as fd:
             fd.extractall(path=path.dirname(outpath))
     assert path.exists(outpath), "Error extracting"
+    return outpath
+
+
+@lru_cache()
+@wraps(get_engine)
+def ensure_mbeautifier(*args, **kwargs):
+    eng = get_engine(*args, **kwargs)
+    outpath = get_mbeautifier()
     log.debug("adding wrappers (%s) to MATLAB path", outpath)
     eng.addpath(outpath, nargout=0)
     return eng
 
 
+def _hash(fname):
+    with open(fname, "rb") as fd:
+        return sha256(fd.read() + MBEAUTIFIER_REV.encode("U8")).hexdigest()
+
+
+def _format(eng, fn):
+    log.debug("file:%s", fn)
+    try:
+        eng.MBeautify.formatFileNoEditor(fn, fn, nargout=0)
+    except Exception as exc:
+        log.error("file:%s:\n%s", fn, exc)
+        return False
+    return True
+
+
 def main(*args, **kwargs):
     args = argopt(__doc__).parse_args(*args, **kwargs)
     logging.basicConfig(level=logging.INFO)
-    eng = ensure_mbeautifier()
-    formatter = eng.MBeautify.formatFileNoEditor
+    fcache = path.join(get_cache_dir(), MBEAUTIFY_CACHE)
+    try:
+        with open(fcache) as fd:
+            cache = json.load(fd)
+    except (IOError, ValueError):
+        cache = {}
+
+    fnames = list(map(path.abspath, args.mfile))
+    if not args.force:
+        fnames = [fn for fn in fnames if cache.get(fn) != _hash(fn)]
+        log.debug("skipping %d unchanged files", len(args.mfile) - len(fnames))
+    if not fnames:
+        return
+
+    if args.jobs > 1 and len(fnames) > 1:
+        outpath = get_mbeautifier()
+        with EnginePool(min(args.jobs, len(fnames)),
+                        init=lambda eng: eng.addpath(outpath, nargout=0)) as pool:
+            res = list(tqdm(pool.map(_format, fnames), total=len(fnames)))
+    else:
+        eng = ensure_mbeautifier()
+        res = list(tmap(lambda fn: _format(eng, fn), fnames))
 
-    for fn in tmap(path.abspath, args.mfile):
-        log.debug("file:%s", fn)
+    with file_lock(f"{fcache}.lock"):
         try:
-            formatter(fn, fn, nargout=0)
-        except Exception as exc:
-            log.error("file:%s:\n%s", fn, exc)
+            with open(fcache) as fd:
+                cache = json.load(fd)
+        except (IOError, ValueError):
+            cache = {}
+        cache.update((fn, _hash(fn)) for fn, ok in zip(fnames, res) if ok)
+        with open(fcache, "w") as fd:
+            json.dump(cache, fd)
 
 
 if __name__ == "__main__": # pragma: no cover
@@ -1,13 +1,14 @@
 from os import path
 from textwrap import dedent
 
-import matplotlib.pyplot as plt
-import numpy as np
-from matplotlib import cm
-
 from .imio import imread
 
-show = plt.show    # convenience: for use after `imscroll`
+
+def show(*args, **kwargs):
+    """`matplotlib.pyplot.show` (convenience: for use after `imscroll`)"""
+    import matplotlib.pyplot as plt
+
+    return plt.show(*args, **kwargs)
 
 
 def apply_cmap(**kwargs):
@@ -22,6 +23,9 @@ def apply_cmap(**kwargs):
     >>> assert res.shape == (10, 10, 10, 4)  # RGBA
     >>> imscroll(res[None])  # (1, 10, 10, 10, 4) for (N, Z, Y, X, RGBA)
     """
+    import numpy as np
+    from matplotlib import cm
+
     res = None
     for v in kwargs.values():
         if res is None:
@@ -44,9 +48,11 @@ class imscroll:
 
     _instances = []
     _SUPPORTED_KEYS = ['control', 'shift']
+    # `multires` idle time (ms) before refining coarse slices
+    _REFINE_MS = 150
 
     def __init__(self, vol, view='t', fig=None, titles=None, order=0, sharexy=None, show=False,
-                 **kwargs):
+                 multires=False, **kwargs):
         """
         Scroll through 2D slices of 3D volume(s) using the mouse.
         Args:
@@ -59,8 +65,14 @@ class imscroll:
                 0: nearest, 1: bilinear, >2: probably avoid.
             sharexy (bool): whether to link zoom across all axes.
             show (bool): whether to run `matplotlib.pyplot.show()`.
+            multires (bool or int): for large (e.g. memory-mapped `getnii`)
+                volumes, lazily read & display slices downsampled to the axes'
+                pixel size, and coarser still (by a factor of `multires`,
+                default 4 if `True`) while scrolling, refining when idle.
             **kwargs: passed to `matplotlib.pyplot.imshow()`.
         """
+        import matplotlib.pyplot as plt
+
         if isinstance(vol, str) and path.exists(vol):
             vol = imread(vol)
         if hasattr(vol, "keys"):
@@ -98,16 +110,27 @@ class imscroll:
         else:
             self.fig, axs = plt.subplots(1, len(vol), sharex=sharexy, sharey=sharexy)
         self.axs = [axs] if len(vol) == 1 else list(axs.flat)
+        self.multires = 4 if multires is True else int(multires)
         for ax, i, t in zip(self.axs, vol, self.titles):
             ax.imshow(i[self.index], **kwargs)
+            if self.multires:
+                # keep full resolution limits when downsampling
+                ax.set_autoscale_on(False)
+                self._set_slice(ax, i[self.index])
+                ax.callbacks.connect('xlim_changed', self._schedule_refine)
+                ax.callbacks.connect('ylim_changed', self._schedule_refine)
             ax.set_title(t or f"slice #{self.index}")
         self.vols = vol
+        if self.multires:
+            self._timer = self.fig.canvas.new_timer(interval=self._REFINE_MS)
+            self._timer.single_shot = True
+            self._timer.add_callback(self._refine)
         # line profiles
         self.order = order
         self.picked = []
         self._annotes = []
         # event callbacks
-        self.key = {i: False for i in self._SUPPORTED_KEYS}
+        self.key = dict.fromkeys(self._SUPPORTED_KEYS, False)
         self.fig.canvas.mpl_connect('scroll_event', self._scroll)
         self.fig.canvas.mpl_connect('key_press_event', self._on_key)
         self.fig.canvas.mpl_connect('key_release_event', self._off_key)
@@ -131,17 +154,62 @@ class imscroll:
             self.key[key] = False
 
     def _scroll(self, event):
-        self.set_index(self.index + event.step * (10 if self.key['shift'] else 1))
+        self.set_index(self.index + event.step * (10 if self.key['shift'] else 1),
+                       coarse=bool(self.multires))
+
+    def _step(self, ax):
+        """`multires` downsampling factor matching `ax`'s pixel size"""
+        bbox = ax.get_window_extent()
+        (x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
+        return max(1,
+                   int(min(abs(x1 - x0) / max(bbox.width, 1),
+                           abs(y1 - y0) / max(bbox.height, 1))))
+
+    def _set_slice(self, ax, arr, coarse=False):
+        """display (a lazily downsampled view of) `arr`"""
+        im = ax.images[0]
+        if not self.multires:
+            im.set_array(arr)
+            return
+        step = self._step(ax) * (self.multires if coarse else 1)
+        arr = arr[::step, ::step]
+        im.set_array(arr)
+        # sample `i` is centred on full resolution pixel `i * step`
+        lo = -step / 2
+        height, width = arr.shape[0] * step + lo, arr.shape[1] * step + lo
+        if im.origin == 'lower':
+            im.set_extent((lo, width, lo, height))
+        else:
+            im.set_extent((lo, width, height, lo))
 
-    def set_index(self, index):
+    def _schedule_refine(self, *_):
+        if hasattr(self, '_timer'):
+            self._timer.stop()
+            self._timer.start()
+
+    def _refine(self):
+        for ax, vol in zip(self.axs, self.vols):
+            self._set_slice(ax, vol[self.index])
+        self.fig.canvas.draw_idle()
+
+    def set_index(self, index, coarse=False):
+        """
+        Args:
+            index (int): slice number.
+            coarse (bool): if `multires`, display coarse slices (refining when idle).
+        """
         self.index = int(index) % self.index_max
         for ax, vol, t in zip(self.axs, self.vols, self.titles):
-            ax.images[0].set_array(vol[self.index])
+            self._set_slice(ax, vol[self.index], coarse=coarse)
             ax.set_title(t or f"slice #{self.index}")
         for ann in self._annotes:
             ann.remove()
         self._annotes = []
-        self.fig.canvas.draw()
+        if coarse:
+            self._schedule_refine()
+            self.fig.canvas.draw_idle()
+        else:
+            self.fig.canvas.draw()
 
     def _on_click(self, event):
         if not self.key['control'] or None in (event.xdata, event.ydata):
@@ -150,13 +218,15 @@ class imscroll:
         if len(self.picked) < 2:
             return
 
+        import matplotlib.pyplot as plt
         import numpy as np
         import scipy.ndimage as ndi
 
         (x0, y0), (x1, y1) = self.picked[:2]
         num = int(np.round(np.hypot(y1 - y0, x1 - x0) * 4)) + 1
         x, y = np.linspace(x0, x1, num), np.linspace(y0, y1, num)
-        arr = event.inaxes.images[0].get_array()
+        # full resolution (c.f. `multires`)
+        arr = np.asarray(self.vols[self.axs.index(event.inaxes)][self.index])
         if arr.ndim == 3:
             z = [
                 ndi.map_coordinates(
@@ -164,7 +234,7 @@ class imscroll:
                     np.vstack((x, y, np.ones_like(x) * i)),
                     order=self.order,
                     mode='nearest',
-                ) for i in range(event.inaxes.images[0].get_array().shape[-1])]
+                ) for i in range(arr.shape[-1])]
         else:
             z = ndi.map_coordinates(arr, np.vstack((x, y)), order=self.order, mode='nearest')
         self.picked = []
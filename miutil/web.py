@@ -1,11 +1,16 @@
+import hashlib
+import json
 import logging
-from os import W_OK, access, path, remove
-from shutil import copyfileobj
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from os import path, remove, replace
+from shutil import copyfile
+from tempfile import mkstemp
+from threading import Event, Lock
+from time import time
 
-try:
-    from urllib.request import urlopen
-except ImportError: # py27
-    from urllib import urlopen
 try:
     from urllib.parse import urlparse
 except ImportError: # py27
@@ -14,12 +19,220 @@ except ImportError: # py27
 import requests
 from tqdm.auto import tqdm
 
-from .fdio import Path, create_dir, fspath
+from .fdio import Path, create_dir, file_lock, fspath, get_cache_dir
 
 log = logging.getLogger(__name__)
+# default download chunk (bytes); `None` would buffer the whole response
+CHUNK_SIZE = 1 << 20
+CACHE_INDEX = ".miutil_cache.json"
+# environment variable: never access the network in `urlopen_cached`
+OFFLINE_ENV = "MIUTIL_OFFLINE"
+
+
+def _session(max_workers=None):
+    """`requests.Session` with a connection pool of `max_workers`"""
+    session = requests.Session()
+    if max_workers:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers,
+                                                pool_maxsize=max_workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+    return session
+
+
+def _range_validator(headers):
+    """`If-Range` value from response `headers` (weak ETags are not allowed)"""
+    etag = headers.get("ETag") or ""
+    return etag if etag and not etag.startswith("W/") else headers.get("Last-Modified")
+
+
+def _if_range(fpart, origin):
+    """
+    `If-Range` validator for resuming `fpart` (with `fpart`.json
+    `{"url", "ETag", "Last-Modified"}`), or `None` if not safely resumable.
+    """
+    try:
+        with open(f"{fpart}.json") as fd:
+            meta = json.load(fd)
+    except (IOError, ValueError):
+        return None
+    return _range_validator(meta) if meta.get("url") == origin else None
+
+
+def _download(fpath, origin, session=None, chunk_size=None, pbar=None, lock=None, hasher=None,
+              response=None):
+    """
+    Download `origin` to `fpath` via `fpath`.part, which is kept on error
+    and resumed (using HTTP `Range` & `If-Range` requests) if the server
+    supports it. The source URL & validators of `fpath`.part are kept in
+    `fpath`.part.json, so that partial downloads of a different URL or
+    version are discarded rather than resumed.
+    On completion `fpath`.part is atomically renamed to `fpath`.
+    Args:
+      session: `requests.Session` (default: new connection).
+      pbar (tqdm): shared progress bar (default: new bar per file).
+      lock: guards `pbar` updates.
+      hasher (hashlib.Hash): updated with the file contents while streaming.
+      response (requests.Response): optional, already requested (streaming,
+        non-partial) response for `origin`.
+    Returns:
+      dict: response headers
+    """
+    lock = lock or nullcontext()
+    chunk_size = chunk_size or CHUNK_SIZE
+    fpart = f"{fpath}.part"
+    if response is None:
+        done = path.getsize(fpart) if path.exists(fpart) else 0
+        validator = _if_range(fpart, origin) if done else None
+        if done and validator is None:
+            log.debug("discarding (unknown origin or version):%s", fpart)
+            done = 0
+        headers = {"Range": f"bytes={done}-", "If-Range": validator} if done else {}
+        d = (session or requests).get(origin, stream=True, headers=headers)
+    else:
+        done, d = 0, response
+    # range not satisfiable: stale partial download
+    if done and d.status_code == 416:
+        d.close()
+        log.debug("restarting:%s", fpart)
+        remove(fpart)
+        return _download(fpath, origin, session=session, chunk_size=chunk_size, pbar=pbar,
+                         lock=lock, hasher=hasher)
+    d.raise_for_status()
+    with open(f"{fpart}.json", "w") as fd:
+        json.dump(dict(_validators(d.headers), url=origin), fd)
+    if done and (d.status_code != 206
+                 or not d.headers.get("Content-Range", "").startswith(f"bytes {done}-")):
+        log.debug("cannot resume:%s", fpart)
+        done = 0
+    if done:
+        log.debug("resuming:%s:from byte %d", fpart, done)
+        if hasher is not None:
+            with open(fpart, "rb") as fi:
+                for chunk in iter(partial(fi.read, chunk_size), b""):
+                    hasher.update(chunk)
+    total = float(d.headers.get("Content-length") or 0)
+    if pbar is None:
+        fprog = tqdm(total=done + total, initial=done, desc=path.basename(fpath), unit="B",
+                     unit_scale=True, unit_divisor=1024, leave=False)
+    else:
+        fprog = pbar
+        with lock:
+            pbar.total += total
+            pbar.refresh()
+    try:
+        n = 0
+        with open(fpart, "ab" if done else "wb") as fo:
+            for chunk in d.iter_content(chunk_size=chunk_size):
+                fo.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                n += len(chunk)
+                with lock:
+                    fprog.update(len(chunk))
+        # correct for unknown/wrong Content-length
+        with lock:
+            fprog.total += n - total
+            fprog.refresh()
+    finally:
+        if pbar is None:
+            fprog.close()
+    replace(fpart, fpath)
+    remove(f"{fpart}.json")
+    return d.headers
 
 
-def get_file(fname, origin, cache_dir=None, chunk_size=None):
+def _download_segmented(fpath, origin, segments=8, session=None, chunk_size=None):
+    """
+    Download `origin` to `fpath` as `segments` concurrent byte ranges,
+    written via `os.pwrite` into a preallocated `fpath`.part.
+    Falls back to `_download` (single stream) if the server rejects `HEAD`,
+    does not advertise `Accept-Ranges: bytes` or ignores a `Range` request,
+    or to resume an existing `fpath`.part.
+    Returns:
+      dict: response headers
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    fpart = f"{fpath}.part"
+    with nullcontext(session) if session else _session(segments) as sess:
+        if segments > 1 and hasattr(os, "pwrite") and not path.exists(fpart):
+            head = sess.head(origin, allow_redirects=True)
+            # e.g. 405/403: treat as ranges unsupported
+            size = int(head.headers.get("Content-Length") or 0) if head.ok else 0
+            ranges = head.headers.get("Accept-Ranges", "").lower() == "bytes"
+            # resolved redirects
+            url = head.url
+            # fail rather than mix versions if `origin` changes mid-download
+            validator = _range_validator(head.headers)
+        else:
+            size = ranges = 0
+        if not (ranges and size):
+            log.debug("single stream:%s", fpath)
+            return _download(fpath, origin, session=sess, chunk_size=chunk_size)
+
+        step = -(-size // segments)
+        bounds = [(i, min(i + step, size) - 1) for i in range(0, size, step)]
+        log.debug("%d segments:%s", len(bounds), fpath)
+        fd = os.open(fpart, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        pbar = tqdm(total=size, desc=path.basename(fpath), unit="B", unit_scale=True,
+                    unit_divisor=1024, leave=False)
+        lock, abort = Lock(), Event()
+
+        def fetch(start, end):
+            if abort.is_set():
+                return False
+            headers = {"Range": f"bytes={start}-{end}"}
+            if validator:
+                headers["If-Range"] = validator
+            d = sess.get(url, stream=True, headers=headers)
+            d.raise_for_status()
+            if d.status_code == 200:
+                # `Range` ignored (or `If-Range` mismatch): fall back to a single stream
+                d.close()
+                abort.set()
+                return False
+            if (d.status_code != 206
+                    or not d.headers.get("Content-Range", "").startswith(f"bytes {start}-")):
+                raise IOError(f"range {start}-{end} not honoured by {origin}")
+            for chunk in d.iter_content(chunk_size=chunk_size):
+                if abort.is_set():
+                    return False
+                if start + len(chunk) > end + 1:
+                    raise IOError(f"range {start}-{end} overrun by {origin}")
+                os.pwrite(fd, chunk, start)
+                start += len(chunk)
+                with lock:
+                    pbar.update(len(chunk))
+            if start != end + 1:
+                raise IOError(f"range {start}-{end} truncated by {origin}")
+            return True
+
+        try:
+            os.ftruncate(fd, size)
+            with ThreadPoolExecutor(len(bounds)) as pool:
+                futures = [pool.submit(fetch, *i) for i in bounds]
+                try:
+                    results = [future.result() for future in futures]
+                except (Exception, KeyboardInterrupt):
+                    abort.set()
+                    raise
+        except (Exception, KeyboardInterrupt):
+            os.close(fd)
+            # holes: not resumable
+            remove(fpart)
+            raise
+        finally:
+            pbar.close()
+        os.close(fd)
+        if not all(results):
+            remove(fpart)
+            log.debug("range ignored, single stream:%s", fpath)
+            return _download(fpath, origin, session=sess, chunk_size=chunk_size)
+    replace(fpart, fpath)
+    return head.headers
+
+
+def get_file(fname, origin, cache_dir=None, chunk_size=None, session=None, segments=None):
     """
     Downloads a file from a URL if it not already in the cache.
     By default the file at the url `origin` is downloaded to the
@@ -36,71 +249,277 @@ def get_file(fname, origin, cache_dir=None, chunk_size=None):
       origin (str): Original URL of the file.
       cache_dir (str): Location to store cached files, when None it
         defaults to `~/.miutil`.
+      session (requests.Session): optional, for connection reuse.
+      segments (int): optional, download this many byte ranges
+        concurrently (falls back to a single stream if unsupported).
+    Interrupted downloads are kept as `fname`.part and resumed on the
+    next call if the server supports HTTP range requests.
     Returns:
       str: Path to the downloaded file
     """
-    if cache_dir is None:
-        cache_dir = path.join("~", ".miutil")
-    cache_dir = path.expanduser(fspath(cache_dir))
-    create_dir(cache_dir)
-    if not access(cache_dir, W_OK):
-        cache_dir = path.join("/tmp", ".miutil")
-        create_dir(cache_dir)
-
-    fpath = path.join(cache_dir, fname)
-
+    fpath = path.join(get_cache_dir(cache_dir), fname)
     if not path.exists(fpath):
         log.debug("Downloading %s from %s", fpath, origin)
-        try:
-            d = requests.get(origin, stream=True)
-            with tqdm(
-                    total=float(d.headers.get("Content-length") or 0),
-                    desc=fname,
-                    unit="B",
-                    unit_scale=True,
-                    unit_divisor=1024,
-                    leave=False,
-            ) as fprog:
-                with open(fpath, "wb") as fo:
-                    for chunk in d.iter_content(chunk_size=chunk_size):
-                        fo.write(chunk)
-                        fprog.update(len(chunk))
-                fprog.total = fprog.n
-                fprog.refresh()
-        except (Exception, KeyboardInterrupt):
-            if path.exists(fpath):
-                remove(fpath)
-            raise
-
+        if segments:
+            _download_segmented(fpath, origin, segments=segments, session=session,
+                                chunk_size=chunk_size)
+        else:
+            _download(fpath, origin, session=session, chunk_size=chunk_size)
     return fpath
 
 
-def urlopen_cached(url, outdir, fname=None, mode="rb"):
+def get_files(files, cache_dir=None, chunk_size=None, max_workers=8):
+    """
+    Concurrent `get_file` for multiple files, sharing a pooled
+    `requests.Session` and an aggregate progress bar.
+
+    Args:
+      files (dict or list): `{fname: origin}` or `[(fname, origin), ...]`.
+      cache_dir (str): as per `get_file`.
+      max_workers (int): maximum concurrent downloads (and connections).
+    Returns:
+      list: Paths to the downloaded files (in input order)
+    """
+    files = list(files.items() if hasattr(files, "items") else files)
+    cache_dir = get_cache_dir(cache_dir)
+    fpaths = [path.join(cache_dir, fname) for fname, _ in files]
+    # unique, missing files
+    todo = {fpath: origin for fpath, (_, origin) in zip(fpaths, files) if not path.exists(fpath)}
+    if todo:
+        log.debug("Downloading %d files to %s", len(todo), cache_dir)
+        lock = Lock()
+        with _session(max_workers) as session, tqdm(
+                total=0, desc=f"Downloading {len(todo)} files", unit="B", unit_scale=True,
+                unit_divisor=1024, leave=False) as pbar, ThreadPoolExecutor(max_workers) as pool:
+            futures = [
+                pool.submit(_download, fpath, origin, session=session, chunk_size=chunk_size,
+                            pbar=pbar, lock=lock) for fpath, origin in todo.items()]
+            for future in futures:
+                future.result()
+    return fpaths
+
+
+def _validators(headers):
+    """`ETag` & `Last-Modified` from response `headers`"""
+    return {k: headers[k] for k in ("ETag", "Last-Modified") if headers.get(k)}
+
+
+def urlopen_cached(url, outdir, fname=None, mode="rb", segments=None, max_age=None, offline=None):
     """
     Download `url` to `outdir/fname`.
     Cache based on `url` at `outdir/fname`.url
+    Interrupted downloads are resumed (see `get_file`).
+    Response validators (`ETag`, `Last-Modified`) are stored in
+    `outdir/fname`.meta.json for conditional revalidation.
 
     Args:
       url (str): source
       outdir (path-like): destination
       fname (str): optional, auto-detected from `url` if not given
       mode (str): for returned file object
+      segments (int): optional, as per `get_file`
+      max_age (float): seconds after which a cached file is revalidated
+        with a conditional request (default: never, 0: always).
+        Network errors during revalidation fall back to the cached file.
+      offline (bool): never access the network
+        (default: `bool(os.environ.get("MIUTIL_OFFLINE"))`).
     Returns:
       file
+    Raises:
+      IOError: if `offline` and `url` is not cached.
     """
+    if offline is None:
+        offline = bool(os.environ.get(OFFLINE_ENV))
     outdir = Path(outdir).expanduser()
     outdir.mkdir(exist_ok=True)
     if fname is None:
         fname = Path(urlparse(url).path).name
     fout = outdir / fname
     cache = outdir / f"{fspath(fname)}.url"
-    if not fout.is_file() or not cache.is_file() or cache.read_text().strip() != url:
-        fi = urlopen(url)
-        with fout.open("wb") as raw:
-            with tqdm.wrapattr(raw, "write", total=getattr(fi, "length", None)) as fo:
-                copyfileobj(fi, fo)
+    fmeta = outdir / f"{fspath(fname)}.meta.json"
+    try:
+        meta = json.loads(fmeta.read_text())
+    except (IOError, ValueError):
+        meta = {}
+    if fout.is_file() and cache.is_file() and cache.read_text().strip() == url:
+        if offline or max_age is None or time() - meta.get("checked", 0) < max_age:
+            return fout.open(mode)
+        headers = {}
+        if meta.get("ETag"):
+            headers["If-None-Match"] = meta["ETag"]
+        if meta.get("Last-Modified"):
+            headers["If-Modified-Since"] = meta["Last-Modified"]
         try:
-            cache.write_text(url)
-        except TypeError:
-            cache.write_text(url.decode("U8"))
+            with requests.get(url, headers=headers, stream=True) as r:
+                if r.status_code == 304:
+                    log.debug("not modified:%s", url)
+                    meta["checked"] = time()
+                    fmeta.write_text(json.dumps(meta))
+                    return fout.open(mode)
+                r.raise_for_status()
+                log.debug("modified:%s", url)
+                headers = _download(fspath(fout), url, response=r)
+        except requests.exceptions.RequestException as exc:
+            log.warning("cannot revalidate:%s:%s", url, exc)
+            return fout.open(mode)
+    elif offline:
+        raise IOError(f"{fout} not cached (offline)")
+    elif segments:
+        headers = _download_segmented(fspath(fout), url, segments=segments)
+    else:
+        headers = _download(fspath(fout), url)
+    fmeta.write_text(json.dumps(dict(_validators(headers), checked=time())))
+    try:
+        cache.write_text(url)
+    except TypeError:
+        cache.write_text(url.decode("U8"))
     return fout.open(mode)
+
+
+def _link(src, dst):
+    """Atomically hard link (or copy if unsupported) `src` to `dst`"""
+    tmp = f"{dst}.link"
+    if path.lexists(tmp):
+        remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        copyfile(src, tmp)
+    replace(tmp, dst)
+
+
+class Cache(object):
+    """
+    Content-addressed download cache, safe for use by concurrent processes.
+    Downloads are SHA-256 hashed while streaming and stored once per
+    unique content as `objects/<sha256>`, hard linked (or copied) to each
+    `<fname>` requested. Least-recently-used files are evicted to keep
+    `objects` within `max_bytes`.
+
+    Args:
+      cache_dir (str): as per `get_file`.
+      max_bytes (int): optional size budget, enforced after each download.
+    """
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.root = get_cache_dir(cache_dir)
+        self.max_bytes = max_bytes
+        self.objects = path.join(self.root, "objects")
+        self.locks = path.join(self.root, "locks")
+        create_dir(self.objects)
+        create_dir(self.locks)
+
+    def _lock(self, fname=None):
+        """per-`fname` (default: index) advisory lock"""
+        key = hashlib.sha256(fname.encode("U8")).hexdigest() if fname else "index"
+        return file_lock(path.join(self.locks, f"{key}.lock"))
+
+    @contextmanager
+    def _index(self):
+        """
+        Locked `{'names': {fname: {'sha256', 'url'}},
+                 'objects': {sha256: {'size', 'atime'}}}`,
+        saved on exit.
+        """
+        findex = path.join(self.root, CACHE_INDEX)
+        with self._lock():
+            try:
+                with open(findex) as fd:
+                    index = json.load(fd)
+            except (IOError, ValueError):
+                index = {"names": {}, "objects": {}}
+            yield index
+            fd, tmp = mkstemp(dir=self.root, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as fo:
+                    json.dump(index, fo)
+                replace(tmp, findex)
+            except (Exception, KeyboardInterrupt):
+                remove(tmp)
+                raise
+
+    def _add(self, index, fname, digest, origin=None):
+        """register & link `fname` to (existing) object `digest`"""
+        fpath = path.join(self.root, fname)
+        entry = index["names"].get(fname, {})
+        if entry.get("sha256") != digest or not path.exists(fpath):
+            create_dir(path.dirname(fpath))
+            _link(path.join(self.objects, digest), fpath)
+        index["names"][fname] = {"sha256": digest, "url": origin or entry.get("url")}
+        index["objects"][digest]["atime"] = time()
+        return fpath
+
+    def get(self, fname, origin, sha256=None, chunk_size=None, session=None):
+        """
+        Cached `get_file`.
+
+        Args:
+          fname (str): name (relative to `cache_dir`).
+          origin (str): URL.
+          sha256 (str): optional expected hex digest. If already cached
+            (under any name), `origin` will not be downloaded.
+        Returns:
+          str: path to the cached file
+        Raises:
+          ValueError: if the download does not match `sha256`.
+        """
+        with self._lock(fname):
+            with self._index() as index:
+                digest = sha256 or index["names"].get(fname, {}).get("sha256")
+                if digest in index["objects"] and path.exists(path.join(self.objects, digest)):
+                    log.debug("cached:%s:%s", fname, digest)
+                    return self._add(index, fname, digest, origin)
+
+            tmp = path.join(self.objects, hashlib.sha256(fname.encode("U8")).hexdigest() + ".tmp")
+            hasher = hashlib.sha256()
+            log.debug("Downloading %s from %s", fname, origin)
+            _download(tmp, origin, session=session, chunk_size=chunk_size, hasher=hasher)
+            digest = hasher.hexdigest()
+            if sha256 and digest != sha256.lower():
+                remove(tmp)
+                raise ValueError(f"{origin}: expected sha256 {sha256}, got {digest}")
+
+            with self._index() as index:
+                fobj = path.join(self.objects, digest)
+                if digest in index["objects"] and path.exists(fobj):
+                    log.debug("duplicate:%s:%s", fname, digest)
+                    remove(tmp)
+                else:
+                    replace(tmp, fobj)
+                    index["objects"][digest] = {"size": path.getsize(fobj)}
+                fpath = self._add(index, fname, digest, origin)
+                self._evict(index, self.max_bytes, keep=(digest,))
+        return fpath
+
+    def _evict(self, index, max_bytes, keep=()):
+        if max_bytes is None:
+            return []
+        objects = index["objects"]
+        total = sum(i["size"] for i in objects.values())
+        evicted = []
+        for digest in sorted(objects, key=lambda k: objects[k]["atime"]):
+            if total <= max_bytes:
+                break
+            if digest in keep:
+                continue
+            for fname in [k for k, v in index["names"].items() if v["sha256"] == digest]:
+                fpath = path.join(self.root, fname)
+                if path.exists(fpath):
+                    remove(fpath)
+                del index["names"][fname]
+                evicted.append(fname)
+            fobj = path.join(self.objects, digest)
+            if path.exists(fobj):
+                remove(fobj)
+            total -= objects.pop(digest)["size"]
+        log.debug("evicted:%s", evicted)
+        return evicted
+
+    def evict(self, max_bytes=None):
+        """
+        Remove least-recently-used files to fit within `max_bytes`
+        (default: `self.max_bytes`).
+        Returns:
+          list: evicted names
+        """
+        with self._index() as index:
+            return self._evict(index, self.max_bytes if max_bytes is None else max_bytes)
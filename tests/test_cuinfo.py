@@ -1,8 +1,91 @@
-from pytest import importorskip, raises
+import sys
+from collections import Counter
+from functools import wraps
+from time import sleep
+from types import ModuleType, SimpleNamespace
 
+from pytest import fixture, importorskip, raises
+
+importorskip("pynvml")
 cuinfo = importorskip("miutil.cuinfo")
 
 
+@fixture
+def nvml(monkeypatch):
+    """mocked `pynvml` (& `nvidia-smi`) with 8 devices, counting calls"""
+    pynvml = ModuleType("pynvml")
+    pynvml.calls = Counter()
+    pynvml.runs = []
+    pynvml.devices = [{
+        "name": f"Fake GPU {i}", "total": 16 << 30, "free": (i + 1) << 30, "util": 10 * i,
+        "cc": (8, i % 2)} for i in range(8)]
+
+    class NVMLError(Exception):
+        pass
+
+    def counted(fn):
+        @wraps(fn)
+        def wrapper(*args):
+            pynvml.calls[fn.__name__] += 1
+            return fn(*args)
+
+        setattr(pynvml, fn.__name__, wrapper)
+        return wrapper
+
+    @counted
+    def nvmlInit():
+        pass
+
+    @counted
+    def nvmlShutdown():
+        pass
+
+    @counted
+    def nvmlDeviceGetCount():
+        return len(pynvml.devices)
+
+    @counted
+    def nvmlDeviceGetHandleByIndex(i):
+        if not 0 <= i < len(pynvml.devices):
+            raise NVMLError("Invalid Argument")
+        return i
+
+    @counted
+    def nvmlDeviceGetMemoryInfo(handle):
+        dev = pynvml.devices[handle]
+        return SimpleNamespace(total=dev["total"], free=dev["free"],
+                               used=dev["total"] - dev["free"])
+
+    @counted
+    def nvmlDeviceGetName(handle):
+        return pynvml.devices[handle]["name"]
+
+    @counted
+    def nvmlDeviceGetUUID(handle):
+        return f"GPU-{handle:08d}"
+
+    @counted
+    def nvmlDeviceGetUtilizationRates(handle):
+        return SimpleNamespace(gpu=pynvml.devices[handle]["util"], memory=0)
+
+    def run(cmd, **kwargs):
+        pynvml.runs.append(cmd[0])
+        return SimpleNamespace(returncode=0,
+                               stdout="\n".join("%d.%d" % dev["cc"] for dev in pynvml.devices))
+
+    pynvml.NVMLError = NVMLError
+    monkeypatch.setitem(sys.modules, "pynvml", pynvml)
+    monkeypatch.setattr(cuinfo, "run", run)
+    caches = [
+        cuinfo._nvml, cuinfo.num_devices, cuinfo._handle, cuinfo._name, cuinfo._uuid,
+        cuinfo._compute_capabilities]
+    for fn in caches:
+        fn.cache_clear()
+    yield pynvml
+    for fn in caches:
+        fn.cache_clear()
+
+
 def test_num_devices():
     devices = cuinfo.num_devices()
     assert isinstance(devices, int)
@@ -50,3 +133,96 @@ def test_cuinfo_cli(capsys):
     cuinfo.main(["--compute"])
     out, _ = capsys.readouterr()
     assert not devices or all(map(int, out.split(" ")))
+
+
+def test_nvml_session(nvml, capsys):
+    assert cuinfo.num_devices() == 8
+    assert cuinfo.name(-1) == "Fake GPU 7"
+    assert cuinfo.name(7) == "Fake GPU 7"
+    assert cuinfo.memory(1) == (16 << 30, 2 << 30, 14 << 30)
+    assert cuinfo.compute_capability(3) == (8, 1)
+    with raises(IndexError):
+        cuinfo.get_handle(8)
+    assert nvml.calls["nvmlInit"] == 1
+    assert nvml.calls["nvmlDeviceGetCount"] == 1
+    assert nvml.calls["nvmlDeviceGetName"] == 1
+
+    cuinfo.main(["--compute", "--nvcc-flags"])
+    cuinfo.main([])
+    out, _ = capsys.readouterr()
+    assert out.count("Device ") == 8
+    assert "-gencode=arch=compute_81,code=compute_81" in out
+    assert nvml.runs == ["nvcc", "nvidia-smi"]
+    assert nvml.calls["nvmlInit"] == 1
+    assert nvml.calls["nvmlDeviceGetName"] == 8
+
+
+def test_sampler(nvml):
+    sampler = cuinfo.Sampler(interval=0.01, maxlen=4, devices=[0, 7])
+    assert sampler.stats()[7]["samples"] == 0
+    with sampler:
+        nvml.devices[7]["free"] = 1 << 30
+        nvml.devices[7]["util"] = 100
+        while len(sampler.samples) < 4:
+            sleep(0.01)
+    assert sampler._thread is None
+    n = len(sampler.samples)
+    sleep(0.05)
+    assert len(sampler.samples) == n == 4, "ring buffer/stopped thread"
+
+    stats = sampler.stats()
+    assert stats[0]["min_free"] == stats[0]["mean_free"] == 1 << 30
+    assert stats[0]["mean_util"] == 0
+    assert stats[7]["min_free"] == 1 << 30
+    assert stats[7]["peak_used"] == 15 << 30
+    assert stats[7]["max_util"] == 100
+
+
+def test_watch(nvml, monkeypatch, capsys):
+    calls = []
+
+    def interrupt(sec):
+        calls.append(sec)
+        if len(calls) > 1:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(cuinfo, "sleep", interrupt)
+    cuinfo.main(["--watch", "2", "-d", "1"])
+    out = capsys.readouterr()[0].splitlines()
+    assert calls == [2, 2]
+    assert out[:2] == ["Device  1:free:2048 MiB:used:14336 MiB:util:10%"] * 2
+    assert out[2:] == ["Device  1:min free:2048 MiB:mean free:2048 MiB:peak used:14336 MiB"]
+
+    # interrupted before the first sample
+    def interrupt_sample(self):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(cuinfo.Sampler, "sample", interrupt_sample)
+    cuinfo.main(["--watch", "2"])
+    assert not capsys.readouterr()[0]
+
+
+def test_select_device(nvml, monkeypatch, tmp_path):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    with raises(ValueError):
+        cuinfo.select_device(policy="random")
+    assert cuinfo.select_device(min_free=9 << 30) is None
+    assert nvml.calls["nvmlDeviceGetMemoryInfo"] == 8
+
+    # recently selected devices are de-prioritised
+    assert [cuinfo.select_device(min_free=6 << 30) for _ in range(4)] == [7, 6, 5, 7]
+    assert cuinfo.select_device(min_free=6 << 30, hold=0) == 7
+    assert [cuinfo.select_device(policy="round_robin", hold=0) for _ in range(3)] == [0, 1, 2]
+    assert cuinfo.select_device(policy="round_robin", devices=[1, 2], hold=0) == 1
+    assert (tmp_path / ".miutil" / cuinfo.SELECT_STATE).is_file()
+
+
+def test_select_cli(nvml, monkeypatch, tmp_path, capsys):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    cuinfo.main(["--select", "1024", "-d", "3"])
+    assert capsys.readouterr()[0] == "GPU-00000003\n"
+    cuinfo.main(["--select", "4096", "--policy", "round_robin"])
+    assert capsys.readouterr()[0] == "GPU-00000004\n"
+    assert cuinfo.uuid(-1) == "GPU-00000007"
+    with raises(SystemExit, match="no device with 9999 MiB free"):
+        cuinfo.main(["--select", "9999"])
@@ -1,8 +1,13 @@
 import logging
-from os import path
+from io import BytesIO
+from os import path, urandom
+from pathlib import Path
 from shutil import rmtree
+from threading import Thread
+from time import sleep
+from zipfile import ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile, ZipInfo
 
-from pytest import importorskip
+from pytest import importorskip, raises
 
 from miutil import fdio
 
@@ -57,3 +62,144 @@ def test_nsort():
     assert fdio.nsort(fnames) == fnames[::-1]
     fnames = [i[9:] for i in fnames]
     assert fdio.nsort(fnames) == fnames[::-1]
+    fnames = [Path(i) for i in fnames]
+    assert fdio.nsort(fnames) == fnames[::-1]
+
+
+def test_nsorted_insert():
+    fnames = [f"frame_{i}.nii" for i in range(0, 20, 2)]
+    assert fdio.nsorted_insert(fnames, "frame_5.nii") == 3
+    assert fdio.nsorted_insert(fnames, "frame_100.nii") == 11
+    assert fdio.nsorted_insert(fnames, Path("frame_1.nii")) == 1
+    assert fnames == fdio.nsort(fnames)
+
+    new = fdio.nsort(["frame_3.nii", "frame_11.nii"])
+    merged = list(fdio.nmerge(fnames, new))
+    assert merged == fdio.nsort(fnames + new)
+
+
+def test_file_lock(tmp_path):
+    flock = tmp_path / "file.lock"
+    events = []
+
+    def worker(i):
+        with fdio.file_lock(flock):
+            events.append(i)
+            sleep(0.05)
+            events.append(i)
+
+    threads = [Thread(target=worker, args=(i,)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert events[::2] == events[1::2]
+    assert flock.is_file()
+
+
+class Stream(object):
+    """non-seekable file-like"""
+    def __init__(self, fd):
+        self.fd = fd
+
+    def read(self, size=-1):
+        return self.fd.read(size)
+
+    def write(self, data):
+        return self.fd.write(data)
+
+    def flush(self):
+        pass
+
+
+def make_zip(fzip, stream=False):
+    """returns `{name: content}`"""
+    files = {
+        "a/1.txt": b"foo" * 10000, "a/2.bin": urandom(100000), "b/3.txt": b"",
+        "run.sh": b"#!/bin/sh\n"}
+    with open(fzip, "wb") as fd:
+        with ZipFile(Stream(fd) if stream else fd, "w") as zipf:
+            zipf.writestr("a/", b"")
+            for fname, content in files.items():
+                info = ZipInfo(fname)
+                info.compress_type = ZIP_STORED if fname.endswith(".bin") else ZIP_DEFLATED
+                info.external_attr = (0o755 if fname.endswith(".sh") else 0o644) << 16
+                zipf.writestr(info, content)
+    return files
+
+
+def test_extractall_select(tmp_path):
+    fzip = tmp_path / "test.zip"
+    files = make_zip(fzip)
+
+    fdio.extractall(fzip, tmp_path / "all")
+    for fname, content in files.items():
+        assert (tmp_path / "all" / fname).read_bytes() == content
+    assert (tmp_path / "all" / "run.sh").stat().st_mode & 0o777 == 0o755
+
+    fdio.extractall(fzip, tmp_path / "select", include="a/*", exclude=["*.bin"])
+    assert sorted(i.name for i in (tmp_path / "select").rglob("*")) == ["1.txt", "a"]
+
+    with fzip.open("rb") as fd:
+        fdio.extractall(fd, tmp_path / "par", n_jobs=3)
+    for fname, content in files.items():
+        assert (tmp_path / "par" / fname).read_bytes() == content
+    assert (tmp_path / "par" / "run.sh").stat().st_mode & 0o777 == 0o755
+
+
+def test_extractall_stream(tmp_path):
+    for stream in (False, True):
+        fzip = tmp_path / f"test{stream:d}.zip"
+        files = make_zip(fzip, stream=stream)
+        dest = tmp_path / f"stream{stream:d}"
+        with fzip.open("rb") as fd:
+            fdio.extractall(Stream(fd), dest, exclude="b/*")
+        for fname, content in files.items():
+            if fname.startswith("b/"):
+                assert not (dest / fname).exists()
+            else:
+                assert (dest / fname).read_bytes() == content
+        assert (dest / "run.sh").stat().st_mode & 0o777 == 0o755
+
+    data = fzip.read_bytes()
+    with raises(EOFError):
+        fdio.extractall(Stream(BytesIO(data[:1000])), tmp_path / "truncated")
+    # truncated at a member boundary/within the central directory
+    end = data.find(b"PK\x01\x02")
+    for size in (end, end + 10, len(data) - 22):
+        with raises(EOFError):
+            fdio.extractall(Stream(BytesIO(data[:size])), tmp_path / "truncated")
+    # not a zip
+    with raises(BadZipFile):
+        fdio.extractall(Stream(BytesIO(b"<html>404 Not Found</html>")), tmp_path / "html")
+    with raises(BadZipFile):
+        fdio.extractall(Stream(BytesIO(data[:end] + b"<html>")), tmp_path / "html")
+    # empty zip
+    empty = BytesIO()
+    ZipFile(empty, "w").close()
+    fdio.extractall(Stream(BytesIO(empty.getvalue())), tmp_path / "empty")
+    files = make_zip(fzip)
+    data = bytearray(fzip.read_bytes())
+    data[data.find(files["a/2.bin"]) + 10] ^= 0xFF
+    corrupt = bytes(data)
+    with raises(IOError):
+        fdio.extractall(Stream(BytesIO(corrupt)), tmp_path / "corrupt")
+
+
+def test_extractall_unsafe(tmp_path):
+    fzip = tmp_path / "unsafe.zip"
+    with ZipFile(fzip, "w") as zipf:
+        for fname in ("../up.txt", "/abs.txt", "a/../../b/c.txt", "./d.txt"):
+            zipf.writestr(fname, b"foo")
+    for stream in (False, True):
+        dest = tmp_path / f"dest{stream:d}"
+        with fzip.open("rb") as fd:
+            fdio.extractall(Stream(fd) if stream else fd, dest)
+        assert sorted(i.relative_to(dest).as_posix()
+                      for i in dest.rglob("*.txt")) == ["a/b/c.txt", "abs.txt", "d.txt", "up.txt"]
+    assert not (tmp_path / "up.txt").exists()
+
+    data = bytearray(fzip.read_bytes())
+    data[6] |= 1   # encrypted flag
+    with raises(BadZipFile, match="up.txt: encrypted"):
+        fdio.extractall(Stream(BytesIO(bytes(data))), tmp_path / "encrypted")
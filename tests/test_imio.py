@@ -1,4 +1,4 @@
-from pytest import importorskip
+from pytest import importorskip, raises, warns
 
 from miutil.fdio import fspath
 from miutil.imio import imread
@@ -28,3 +28,292 @@ def test_nii(tmp_path):
     nii.array2nii(x, np.eye(4), fname, flip=(1, 1, 1))
     nii.nii_gzip(fname)
     assert (imread(f"{fspath(fname)}.gz") == x).all()
+
+
+def test_niisort_lazy(tmp_path):
+    nii = importorskip("miutil.imio.nii")
+
+    x = np.random.random((3, 4, 5, 6)).astype(np.float32)
+    fims = []
+    for i in range(len(x)):
+        fname = tmp_path / f"test_niisort_frm{i}.nii"
+        nii.array2nii(x[i], np.eye(4), fname, flip=(1, 1, 1))
+        fims.append(fspath(fname))
+
+    dense = nii.niisort(fims, memlim=False)
+    lazy = nii.niisort(fims, lazy=True)
+    assert isinstance(dense["im"], np.ndarray)
+    assert isinstance(lazy["im"], nii.LazyNii4D)
+    assert lazy["im"].shape == dense["im"].shape == x.shape
+    assert (lazy["im"][1] == x[1]).all()
+    assert (lazy["im"][-1, 2, ::-1] == x[-1, 2, ::-1]).all()
+    assert (lazy["im"][:, :, 1:3, 4] == x[:, :, 1:3, 4]).all()
+    assert (np.asarray(lazy["im"]) == dense["im"]).all()
+
+
+def test_niisort_parallel(tmp_path):
+    nii = importorskip("miutil.imio.nii")
+
+    x = np.random.random((4, 3, 4, 5)).astype(np.float32)
+    fims = []
+    for i in range(len(x)):
+        fname = tmp_path / f"test_niisort_frm{i}.nii.gz"
+        nii.array2nii(x[i], np.eye(4), fname, flip=(1, 1, 1))
+        fims.append(fspath(fname))
+    fims = fims[::-1]
+
+    assert (nii.niisort(fims, memlim=False)["im"] == x).all()
+    assert (nii.niisort(fims, memlim=False, n_jobs=2)["im"] == x).all()
+    assert (nii.niisort(fims, memlim=False, n_jobs=-1, single_pass=True)["im"] == x).all()
+    assert (nii.niisort(fims, memlim=False, n_jobs=2, processes=True)["im"] == x).all()
+
+
+def test_nii_gzip(tmp_path):
+    nii = importorskip("miutil.imio.nii")
+
+    x = np.random.random((7, 8, 9))
+    fname = tmp_path / "test_nii_gzip.nii"
+    nii.array2nii(x, np.eye(4), fname, flip=(1, 1, 1))
+    raw = fname.read_bytes()
+
+    fgz = nii.nii_gzip(fname, chunk_size=1024, compresslevel=1, inplace=True)
+    assert not fname.exists()
+    assert (imread(fgz) == x).all()
+
+    outpath = tmp_path / "out"
+    outpath.mkdir()
+    fout = nii.nii_ugzip(fgz, outpath=outpath, chunk_size=1024)
+    assert (outpath / "test_nii_gzip.nii").read_bytes() == raw
+    assert (tmp_path / "test_nii_gzip.nii.gz").exists()
+    nii.nii_ugzip(fgz, inplace=True)
+    assert not (tmp_path / "test_nii_gzip.nii.gz").exists()
+    assert fname.read_bytes() == raw
+    assert fout == fspath(outpath / "test_nii_gzip.nii")
+
+
+def test_nii_gzip_threads(tmp_path, monkeypatch):
+    nii = importorskip("miutil.imio.nii")
+
+    x = np.random.random((20, 30, 40))
+    fname = tmp_path / "test_nii_gzip_threads.nii"
+    nii.array2nii(x, np.eye(4), fname, flip=(1, 1, 1))
+    fgz = nii.nii_gzip(fname, chunk_size=10000, threads=4)
+    assert (imread(fgz) == x).all()
+    with open(fgz, "rb") as fd:
+        assert fd.read().count(b"\x1f\x8b\x08") > 1 # multiple members
+
+    fname = tmp_path / "test_array2nii_threads.nii.gz"
+    monkeypatch.setenv(nii.GZIP_THREADS_ENV, "2")
+    nii.array2nii(x, np.eye(4), fname, flip=(1, 1, 1))
+    assert (imread(fname) == x).all()
+    # no temporary files left behind
+    assert len(list(tmp_path.iterdir())) == 3
+
+
+def test_getnii_copy(tmp_path):
+    nii = importorskip("miutil.imio.nii")
+
+    x = np.random.random((4, 5, 6)).astype(np.float32)
+    x[1, 2, 3] = np.nan
+    fname = tmp_path / "test_getnii_copy.nii"
+    nii.array2nii(x, np.eye(4), fname, flip=(1, 1, 1))
+    raw = fname.read_bytes()
+
+    im = nii.getnii(fname, copy=False)
+    assert isinstance(im, np.memmap) and not im.flags.owndata
+    assert np.isnan(im[1, 2, 3])
+    im = nii.getnii(fname, copy=True)
+    assert im.flags.owndata and im.flags.c_contiguous
+    assert np.isnan(im[1, 2, 3])
+
+    im = nii.getnii(fname, nan_replace=0, copy=False)
+    assert isinstance(im, np.memmap) # not copied in full
+    assert im[1, 2, 3] == 0
+    assert not np.isnan(im).any()
+    assert fname.read_bytes() == raw
+    assert np.isnan(nii.getnii(fname)[1, 2, 3])
+
+    fgz = nii.nii_gzip(fname)
+    with raises(ValueError):
+        nii.getnii(fgz, copy=False)
+    assert np.isnan(nii.getnii(fgz)[1, 2, 3])
+
+
+def test_getnii_roi(tmp_path):
+    nii = importorskip("miutil.imio.nii")
+    nib = importorskip("nibabel")
+
+    x = np.random.random((6, 5, 4, 3)).astype(np.float32)
+    affine = np.array([[0, 1, 0, 0], [0, 0, -1, 0], [1, 0, 0, 0], [0, 0, 0, 1.]])
+    for fname in (tmp_path / "test_getnii_roi.nii", tmp_path / "test_getnii_roi.nii.gz"):
+        nib.save(nib.Nifti1Image(x, affine), fspath(fname))
+        full = nii.getnii(fname)
+        assert full.ndim == 4
+        for roi in [1, (slice(1, 3), -1), (slice(None, None, -2), slice(3, 0, -1), 2)]:
+            key = roi if isinstance(roi, tuple) else (roi,)
+            assert (nii.getnii(fname, roi=roi) == full[(slice(None),) + key]).all()
+            assert (nii.getnii(fname, roi=roi, frames=1) == full[(1,) + key]).all()
+        assert (nii.getnii(fname, frames=slice(None, None, -1)) == full[::-1]).all()
+        assert nii.getnii(fname, roi=slice(2, 2)).shape[1] == 0
+
+    with raises(IndexError):
+        nii.getnii(fname, frames=0, roi=(0, 0, 0, 0))
+    nib.save(nib.Nifti1Image(x[..., 0], affine), fspath(fname))
+    with raises(IndexError):
+        nii.getnii(fname, frames=0)
+
+
+def test_nii_header_index(tmp_path, monkeypatch):
+    nii = importorskip("miutil.imio.nii")
+    nib = importorskip("nibabel")
+
+    x = np.random.random((3, 4, 5, 6)).astype(np.float32)
+    affine = np.array([[0, 2, 0, 1], [0, 0, -2, 2], [2, 0, 0, 3], [0, 0, 0, 1.]])
+    fims = []
+    for i in range(len(x)):
+        fname = tmp_path / f"test_nii_index_frm{i}.nii{'.gz' if i % 2 else ''}"
+        nib.save(nib.Nifti1Image(x[i], affine), fspath(fname))
+        fims.append(fspath(fname))
+        assert (nii.getnii(fname, output='affine') == nib.load(fspath(fname)).affine).all()
+        assert nii.nii_header(fname).get_data_shape() == x[i].shape
+
+    index = nii.nii_index(tmp_path)
+    assert list(index) == fims
+    assert (tmp_path / nii.NII_INDEX).is_file()
+    assert index[fims[1]]['shape'] == [4, 5, 6]
+    assert index[fims[1]]['frame'] == 1
+    assert index[fims[1]]['voxsize'] == [2, 2, 2]
+    assert (np.array(index[fims[1]]['affine']) == affine).all()
+
+    dense = nii.niisort(fims, memlim=False)
+    with monkeypatch.context() as m:
+        m.setattr(nii, "nii_header", None) # must use cache
+        assert nii.nii_index(fims[::-1]) == {i: index[i] for i in fims[::-1]}
+        res = nii.niisort(fims, memlim=False, index=True)
+        assert (res['im'] == dense['im']).all()
+        assert (res['affine'] == dense['affine']).all()
+        res = nii.niisort(fims, memlim=False, index=True, single_pass=True)
+        assert (res['im'] == dense['im']).all()
+        assert nii.niisort(fims, lazy=True, index=True)['im'].shape == dense['im'].shape
+
+    nii.array2nii(x[0, :2], affine, fims[0])
+    assert nii.nii_index(fims)[fims[0]]['shape'] == [6, 5, 2]
+
+
+def test_frames2nii(tmp_path):
+    nii = importorskip("miutil.imio.nii")
+
+    x = np.random.random((3, 4, 5, 6)).astype(np.float32)
+    affine = np.array([[0, 2, 0, 1], [0, 0, -2, 2], [2, 0, 0, 3], [0, 0, 0, 1.]])
+    fref = tmp_path / "test_frames2nii_ref.nii"
+    nii.array2nii(x, affine, fref, descrip="test")
+    ref = nii.getnii(fref, output='all')
+
+    fname = tmp_path / "test_frames2nii.nii"
+    nii.frames2nii((i for i in x), affine, fname, descrip="test")
+    assert fname.read_bytes() == fref.read_bytes()
+
+    fname = tmp_path / "test_frames2nii.nii.gz"
+    nii.frames2nii(ref['im'], affine, fname, storage_as=ref, dtype=np.float64, threads=2)
+    res = nii.getnii(fname, output='all')
+    assert (res['im'] == ref['im']).all()
+    assert res['dtype'] == np.float64
+    assert res['hdr']['cal_max'] == ref['hdr']['cal_max']
+    assert len(list(tmp_path.iterdir())) == 3 # no temporary files left behind
+
+    # NaN in every frame
+    x[:, 0, 0, 0] = np.nan
+    nii.array2nii(x, affine, fref, descrip="test")
+    fname = tmp_path / "test_frames2nii.nii"
+    nii.frames2nii(x, affine, fname, descrip="test")
+    assert np.isnan(nii.getnii(fname, output='all')['hdr']['cal_max'])
+    assert fname.read_bytes() == fref.read_bytes()
+
+
+def test_Nifti4DWriter(tmp_path):
+    nii = importorskip("miutil.imio.nii")
+
+    x = np.random.random((4, 5, 6, 7)).astype(np.float32)
+    affine = np.diag([2, 2, 2, 1.])
+    fref = tmp_path / "test_Nifti4DWriter_ref.nii"
+    nii.array2nii(x, affine, fref)
+    geom = nii.getnii(fref, output='all')
+
+    for ext, threads in ((".nii", None), (".nii.gz", 2), (".nii.gz", None)):
+        fname = tmp_path / f"test_Nifti4DWriter{ext}"
+        with nii.Nifti4DWriter(fname, affine, nframes=len(x), storage_as=geom,
+                               threads=threads) as writer:
+            for frame in geom['im']:
+                writer.append(frame)
+            # no temporary files
+            outputs = {fref.name, "test_Nifti4DWriter.nii", fname.name}
+            assert {i.name for i in tmp_path.iterdir()} <= outputs
+        res = nii.getnii(fname, output='all')
+        assert (res['im'] == geom['im']).all()
+        assert res['hdr']['cal_min'] == x.min()
+
+    # fewer frames than preallocated
+    with nii.Nifti4DWriter(fname, affine, nframes=len(x) + 2) as writer:
+        for frame in x:
+            writer.append(frame)
+    assert (nii.getnii(fname) == geom["im"]).all()
+
+    # errors clean up
+    fname = tmp_path / "test_Nifti4DWriter_err.nii.gz"
+    with raises(IndexError):
+        with nii.Nifti4DWriter(fname, affine, nframes=1) as writer:
+            for frame in x:
+                writer.append(frame)
+    with raises(ValueError):
+        with nii.Nifti4DWriter(fname, affine) as writer:
+            writer.append(x[0])
+            writer.append(x[0, :2])
+    with raises(ValueError):
+        nii.frames2nii([], affine, fname)
+    assert len(list(tmp_path.iterdir())) == 3
+
+
+def test_nii_modify(tmp_path):
+    nii = importorskip("miutil.imio.nii")
+
+    fims = []
+    for i in range(3):
+        x = np.random.randint(-100, 1000, size=(7, 8, 9)).astype(np.int16)
+        fname = tmp_path / f"test_nii_modify{i}.nii"
+        nii.array2nii(x, np.eye(4), fname, flip=(1, 1, 1))
+        fims.append(fname)
+
+    res = nii.nii_modify(fims[0], voxel_range=[0, 1])
+    assert res["fim"] == fspath(tmp_path / "test_nii_modify0_nimpa-modified.nii.gz")
+    assert res["im"].dtype == np.float64
+    assert res["im"].min() == 0 and np.isclose(res["im"].max(), 1)
+    out = nii.getnii(res["fim"], output='all')
+    assert np.allclose(out['im'], res["im"])
+    assert (out['hdr']['cal_min'], out['hdr']['cal_max']) == (0, 1)
+
+    dct = nii.getnii(fims[1], output='all')
+    dct['im'] = np.array(dct['im'], dtype=np.float32)
+    im = dct['im']
+    res = nii.nii_modify(dct, voxel_range=[2], inplace=True, fcomment="_max")
+    assert res["im"] is im and np.isclose(im.max(), 2)
+    assert res["fim"] == fspath(tmp_path / "test_nii_modify1_max.nii.gz")
+    with raises(TypeError):
+        nii.nii_modify(dct, voxel_range=[2], inplace=True, out_dtype=np.int16)
+    res = nii.nii_modify(dct, voxel_range=[-10, 10], out_dtype=np.int16, fcomment="_int")
+    assert res["im"].dtype == np.int16
+    assert res["im"].min() == -10 and res["im"].max() == 10
+    assert nii.getnii(res["fim"]).dtype == np.int16
+
+    # all-zero: NaN (with a warning) rather than `ZeroDivisionError`
+    dct['im'] = np.zeros_like(dct['im'])
+    for voxel_range in ([2], [0, 1]):
+        with warns(RuntimeWarning):
+            res = nii.nii_modify(dct, voxel_range=voxel_range, fcomment="_zero")
+        assert np.isnan(res["im"]).all()
+
+    fouts = nii.nii_modify_batch(fims, n_jobs=2, voxel_range=[0, 1], fcomment="_batch")
+    assert len(fouts) == 3
+    for fout in fouts:
+        assert fout.endswith("_batch.nii.gz")
+        im = nii.getnii(fout)
+        assert im.min() == 0 and np.isclose(im.max(), 1)
@@ -0,0 +1,52 @@
+import sys
+from subprocess import STDOUT, check_output
+
+from pytest import mark, raises
+
+# lazily imported
+HEAVY = {"argopt", "matplotlib", "numpy", "pynvml", "requests", "tqdm", "zipfile"}
+# cumulative `import miutil` budget (microseconds)
+BUDGET_US = 20000
+
+
+def importtime(module):
+    """`{name: cumulative microseconds}` from `python -X importtime -c 'import <module>'`"""
+    out = check_output([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                       stderr=STDOUT, universal_newlines=True)
+    res = {}
+    for line in out.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if name.strip() == "site": # ignore interpreter startup
+                res = {}
+            elif cumulative.strip().isdigit():
+                res[name.strip()] = int(cumulative)
+    return res
+
+
+def test_import_budget():
+    times = importtime("miutil")
+    assert times["miutil"] < BUDGET_US
+    assert not HEAVY.intersection(i.split(".")[0] for i in times)
+
+
+@mark.parametrize("module", ["miutil.fdio", "miutil.cuinfo", "miutil.plot", "miutil.mlab"])
+def test_import_lazy(module):
+    times = importtime(module)
+    assert module in times
+    assert not HEAVY.intersection(i.split(".")[0] for i in times)
+
+
+def test_lazy_attributes():
+    import miutil
+    from miutil import fdio
+
+    assert miutil.fdio is fdio
+    assert miutil.nsort is fdio.nsort
+    assert miutil.web.__name__ == "miutil.web"
+    with raises(AttributeError):
+        miutil.not_a_submodule
+
+    ns = {}
+    exec("from miutil import *", ns) # NOQA: S102
+    assert {"tqdm", "ZipFile", "CallbackIOWrapper", "nsort"}.issubset(ns)
@@ -1,4 +1,13 @@
-from pytest import fixture, importorskip, mark, skip
+import json
+import os
+import sys
+from functools import partial
+from itertools import count
+from queue import Empty
+from subprocess import CalledProcessError
+from time import sleep
+
+from pytest import fixture, importorskip, mark, raises, skip
 
 
 @fixture
@@ -50,3 +59,199 @@ def test_beautify(eng):
 
     eng = beautify.ensure_mbeautifier()
     assert eng.MBeautify.formatFileNoEditor
+
+
+class FakeEngineError(RuntimeError):
+    pass
+
+
+class FakeEngine(object):
+    """minimal stand-in for `matlab.engine.MatlabEngine`"""
+    def __init__(self, started):
+        self.alive = True
+        self.calls = 0
+        started.append(self)
+
+    def eval(self, expr, nargout=1):
+        if not self.alive:
+            raise FakeEngineError("dead")
+
+    def sqrt(self, x):
+        self.eval("")
+        self.calls += 1
+        if x < 0:
+            self.alive = False
+            raise FakeEngineError("crash")
+        return x**0.5
+
+    def quit(self):
+        self.alive = False
+
+
+def test_EnginePool():
+    mlab = importorskip("miutil.mlab")
+    started = []
+    init = []
+    with mlab.EnginePool(3, factory=partial(FakeEngine, started), init=init.append,
+                         errors=(FakeEngineError,)) as pool:
+        assert len(started) == 3 and init == started
+
+        # scheduling: all engines used
+        res = list(pool.map(lambda eng, x: (sleep(0.01), eng.sqrt(x))[1], range(30)))
+        assert res == [x**0.5 for x in range(30)]
+        assert sum(eng.calls for eng in started) == 30
+        assert all(eng.calls for eng in started)
+
+        # checkout/checkin
+        engs = [pool.checkout() for _ in range(3)]
+        with raises(Empty):
+            pool.checkout(timeout=0.01)
+        for eng in engs:
+            pool.checkin(eng)
+
+        # restart on error (with retry)
+        crashes = [-1]
+
+        def crash_once(eng, x):
+            return eng.sqrt(crashes.pop() if crashes else x)
+
+        assert list(pool.map(crash_once, [4])) == [2]
+        # lazy restart
+        assert len(started) == 3 and list(pool.engines.queue).count(None) == 1
+        with raises(FakeEngineError):
+            list(pool.map(lambda eng, x: eng.sqrt(x), [-1], retries=0))
+        assert list(pool.engines.queue).count(None) == 2
+        engs = [pool.checkout() for _ in range(3)]
+        assert len(started) == 5 and all(eng.alive for eng in engs)
+        for eng in engs:
+            pool.checkin(eng)
+
+        # health check on checkout
+        for eng in started:
+            eng.alive = False
+        assert list(pool.map(lambda eng, x: eng.sqrt(x), [9])) == [3]
+        assert len(started) == 6
+    assert not any(eng.alive for eng in started)
+
+    # failed start-up: no leaks
+    started, counter = [], count()
+
+    def factory():
+        if next(counter) == 2:
+            raise FakeEngineError("licence")
+        return FakeEngine(started)
+
+    with raises(FakeEngineError, match="licence"):
+        mlab.EnginePool(4, factory=factory, errors=(FakeEngineError,))
+    assert len(started) == 3 and not any(eng.alive for eng in started)
+
+    def fail_init(eng):
+        raise FakeEngineError("init")
+
+    started = []
+    with raises(FakeEngineError, match="init"):
+        mlab.EnginePool(2, factory=partial(FakeEngine, started), init=fail_init,
+                        errors=(FakeEngineError,))
+    assert len(started) == 2 and not any(eng.alive for eng in started)
+
+
+class FakeMBeautify(object):
+    def __init__(self, calls):
+        self.calls = calls
+
+    def formatFileNoEditor(self, fin, fout, nargout=1):
+        self.calls.append(fin)
+        with open(fout, "a") as fd:
+            fd.write("% formatted\n")
+
+
+def test_beautify_main(tmp_path, monkeypatch):
+    mlab = importorskip("miutil.mlab")
+    beautify = importorskip("miutil.mlab.beautify")
+    calls, started = [], []
+
+    def factory():
+        eng = FakeEngine(started)
+        eng.MBeautify = FakeMBeautify(calls)
+        eng.addpath = lambda *args, **kwargs: None
+        return eng
+
+    monkeypatch.setattr(beautify, "get_cache_dir", lambda: str(tmp_path))
+    monkeypatch.setattr(beautify, "get_mbeautifier", lambda: str(tmp_path))
+    monkeypatch.setattr(beautify, "ensure_mbeautifier", factory)
+    monkeypatch.setattr(beautify, "EnginePool", partial(mlab.EnginePool, factory=factory,
+                                                        errors=()))
+    fnames = [tmp_path / f"file{i}.m" for i in range(5)]
+    for fn in fnames:
+        fn.write_text("x=1;\n")
+
+    beautify.main(["-j", "3"] + list(map(str, fnames)))
+    assert sorted(calls) == sorted(map(str, fnames))
+    assert all(fn.read_text().endswith("% formatted\n") for fn in fnames)
+    assert (tmp_path / beautify.MBEAUTIFY_CACHE).is_file()
+
+    # unchanged: skipped
+    calls.clear()
+    fnames[1].write_text("y=2;\n")
+    beautify.main(list(map(str, fnames)))
+    assert calls == [str(fnames[1])]
+
+    calls.clear()
+    beautify.main(["--force", str(fnames[0])])
+    assert calls == [str(fnames[0])]
+
+
+@mark.skipif(sys.platform.startswith("win"), reason="POSIX shell script")
+def test_matlabroot_cache(tmp_path, monkeypatch):
+    mlab = importorskip("miutil.mlab")
+    monkeypatch.setattr(mlab, "get_cache_dir", lambda: str(tmp_path))
+    calls = tmp_path / "calls"
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    exe = bindir / "matlab"
+    exe.write_text(f'#!/bin/sh\necho . >> "{calls}"\necho "MATLAB       =  /opt/R2099z"\n')
+    exe.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+
+    assert mlab.matlabroot() == "/opt/R2099z"
+    assert mlab.matlabroot() == "/opt/R2099z"
+    assert calls.read_text() == ".\n"
+    info = json.loads((tmp_path / mlab.MATLAB_CACHE).read_text())[str(exe.resolve())]
+    assert info["root"] == "/opt/R2099z" and info["version"] == "2099z"
+
+    # invalidated by mtime
+    st = exe.stat()
+    os.utime(exe, (st.st_atime, st.st_mtime + 10))
+    assert mlab.matlabroot() == "/opt/R2099z"
+    assert calls.read_text() == ".\n.\n"
+    assert mlab._matlab_cache(engine={"python": True})["root"] == "/opt/R2099z"
+    assert mlab._matlab_cache()["engine"] == {"python": True}
+    # merged under lock
+    assert mlab._matlab_cache(engine={"python3": False})["engine"] == {
+        "python": True, "python3": False}
+    assert mlab._matlab_cache(engine={"python": None})["engine"] == {"python3": False}
+    assert mlab._matlab_cache()["root"] == "/opt/R2099z"
+
+    # failed installs retried after `ENGINE_RETRY`
+    setups = []
+
+    def setup():
+        setups.append(now[0])
+        if len(setups) < 3:
+            raise CalledProcessError(1, "setup.py")
+        return "installed"
+
+    now = [1000.0]
+    monkeypatch.setattr(mlab, "_install_engine_setup", setup)
+    monkeypatch.setattr(mlab, "time", lambda: now[0])
+    for _ in range(2):
+        with raises(CalledProcessError):
+            mlab._install_engine()
+    assert setups == [1000.0]
+    now[0] += mlab.ENGINE_RETRY
+    with raises(CalledProcessError):
+        mlab._install_engine()
+    now[0] += mlab.ENGINE_RETRY
+    assert mlab._install_engine() == "installed"
+    assert len(setups) == 3
+    assert sys.executable not in mlab._matlab_cache()["engine"]
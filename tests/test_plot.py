@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+from pytest import fixture, importorskip
+
+np = importorskip("numpy")
+mpl = importorskip("matplotlib")
+mpl.use("Agg")
+plt = importorskip("matplotlib.pyplot")
+plot = importorskip("miutil.plot")
+
+
+@fixture
+def vol(tmp_path):
+    fname = tmp_path / "vol.npy"
+    np.save(fname, np.arange(8 * 512 * 512, dtype=np.float32).reshape(8, 512, 512))
+    yield np.load(fname, mmap_mode="r")
+    plot.imscroll._instances.clear()
+    plt.close("all")
+
+
+def test_imscroll(vol):
+    scroller = plot.imscroll([vol, vol], titles=["a", "b"])
+    assert scroller.index == 4
+    assert scroller.axs[1].images[0].get_array().shape == (512, 512)
+    scroller.set_index(9)
+    assert scroller.index == 1
+    assert scroller.axs[0].get_title() == "a"
+    assert scroller.axs[0].images[0].get_array()[0, 1] == 512*512 + 1
+
+
+def test_imscroll_multires(vol):
+    fig = plt.figure(figsize=(2, 2), dpi=64)
+    scroller = plot.imscroll(vol, fig=fig, multires=2)
+    ax = scroller.axs[0]
+    step = scroller._step(ax)
+    assert step > 1
+    im = ax.images[0]
+    assert im.get_array().shape == (-(-512 // step),) * 2
+    assert ax.get_xlim() == (-0.5, 511.5)
+
+    scroller._scroll(SimpleNamespace(step=1))
+    assert scroller.index == 5
+    assert im.get_array().shape == (-(-512 // (2*step)),) * 2
+    assert im.get_array()[0, 1] == 5*512*512 + 2*step
+    # samples centred on their full resolution pixels
+    left, right, bottom, top = im.get_extent()
+    assert left == top == -step
+    assert right == bottom == (-(-512 // (2*step)) - 0.5) * 2 * step
+    assert ax.get_xlim() == (-0.5, 511.5)
+
+    scroller._refine()
+    assert im.get_array().shape == (-(-512 // step),) * 2
+    ax.set_xlim(0, 64)
+    ax.set_ylim(64, 0)
+    scroller._refine()
+    assert im.get_array().shape == (512, 512)
@@ -1,4 +1,89 @@
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from hashlib import sha256
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from threading import Thread
+from zipfile import ZipFile
+
+from pytest import fixture, raises
+
 from miutil import web
+from miutil.fdio import extractall
+
+
+class Handler(SimpleHTTPRequestHandler):
+    """
+    Adds `ETag` & `Range: bytes=<start>-[<end>]` (with optional `If-Range`)
+    support (if `ranges`), and optional truncation.
+    """
+    ranges = True
+    ignore_range = False # advertise `Accept-Ranges` but always send 200
+    head_status = None   # error status for `HEAD` requests
+    truncate = None      # send only this many body bytes
+    requests = None      # log of (path, Range header)
+
+    def log_message(self, *args, **kwargs):
+        pass
+
+    def send_head(self):
+        self.requests.append((self.path, self.headers.get("Range")))
+        if self.command == "HEAD" and self.head_status:
+            self.send_error(self.head_status)
+            return None
+        fpath = Path(self.translate_path(self.path))
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range") or "")
+        if not fpath.is_file() or not (self.ranges or self.truncate):
+            return super(Handler, self).send_head()
+        data = fpath.read_bytes()
+        etag = f'"{sha256(data).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return None
+        if (match and self.ranges and not self.ignore_range
+                and self.headers.get("If-Range") in (None, etag)):
+            start, end = int(match.group(1)), int(match.group(2) or len(data) - 1)
+            if start >= len(data):
+                self.send_error(416)
+                return None
+            end = min(end, len(data) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            start, end = 0, len(data) - 1
+            self.send_response(200)
+        if self.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(end + 1 - start))
+        self.end_headers()
+        return BytesIO(data[start:end + 1][:self.truncate])
+
+
+@fixture
+def handler():
+    """per-test `Handler` subclass (configurable class attributes)"""
+    return type("Handler", (Handler,), {"requests": []})
+
+
+@fixture
+def server(tmp_path, handler):
+    """local HTTP server: yields (base URL, served directory)"""
+    root = tmp_path / "server"
+    root.mkdir()
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=str(root)))
+    thread = Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}", root
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
 
 
 def test_get_file(tmp_path):
@@ -12,6 +97,263 @@ def test_get_file(tmp_path):
     assert (tmpdir / "README.rst").is_file()
 
 
+def test_get_files(tmp_path, server):
+    url, root = server
+    data = {f"file{i}.bin": bytes(range(256)) * (i+1) * 100 for i in range(5)}
+    for fname, content in data.items():
+        (root / fname).write_bytes(content)
+
+    tmpdir = tmp_path / "get_files"
+    files = {fname: f"{url}/{fname}" for fname in data}
+    fpaths = web.get_files(files, cache_dir=tmpdir, max_workers=3)
+    assert fpaths == [web.fspath(tmpdir / fname) for fname in data]
+    for fname, content in data.items():
+        assert (tmpdir / fname).read_bytes() == content
+
+    # cached
+    (root / "file0.bin").unlink()
+    assert web.get_files([("file0.bin", f"{url}/file0.bin")], cache_dir=tmpdir) == fpaths[:1]
+
+
+def test_get_file_resume(tmp_path, server, handler):
+    url, root = server
+    data = bytes(range(256)) * 1000
+    (root / "file.bin").write_bytes(data)
+    tmpdir = tmp_path / "resume"
+
+    # interrupted
+    handler.truncate = 100000
+    with raises(web.requests.exceptions.RequestException):
+        web.get_file("file.bin", f"{url}/file.bin", cache_dir=tmpdir, chunk_size=4096)
+    assert not (tmpdir / "file.bin").exists()
+    assert data[:100000].startswith((tmpdir / "file.bin.part").read_bytes())
+    done = (tmpdir / "file.bin.part").stat().st_size
+    assert done
+
+    # resumed
+    handler.truncate = None
+    handler.requests.clear()
+    fpath = web.get_file("file.bin", f"{url}/file.bin", cache_dir=tmpdir)
+    assert handler.requests == [("/file.bin", f"bytes={done}-")]
+    assert Path(fpath).read_bytes() == data
+    assert not (tmpdir / "file.bin.part").exists()
+    assert not (tmpdir / "file.bin.part.json").exists()
+
+    # modified upstream: not resumed
+    (tmpdir / "file.bin").unlink()
+    handler.truncate = 100000
+    with raises(web.requests.exceptions.RequestException):
+        web.get_file("file.bin", f"{url}/file.bin", cache_dir=tmpdir, chunk_size=4096)
+    done = (tmpdir / "file.bin.part").stat().st_size
+    data = data[::-1]
+    (root / "file.bin").write_bytes(data)
+    handler.truncate = None
+    handler.requests.clear()
+    fpath = web.get_file("file.bin", f"{url}/file.bin", cache_dir=tmpdir)
+    assert handler.requests == [("/file.bin", f"bytes={done}-")]
+    assert Path(fpath).read_bytes() == data
+
+    # different URL: not resumed
+    (tmpdir / "file.bin").unlink()
+    (root / "other.bin").write_bytes(data[::-1])
+    handler.truncate = 100000
+    with raises(web.requests.exceptions.RequestException):
+        web.get_file("file.bin", f"{url}/other.bin", cache_dir=tmpdir, chunk_size=4096)
+    handler.truncate = None
+    handler.requests.clear()
+    fpath = web.get_file("file.bin", f"{url}/file.bin", cache_dir=tmpdir)
+    assert handler.requests == [("/file.bin", None)]
+    assert Path(fpath).read_bytes() == data
+
+    # stale (larger than remote)
+    (tmpdir / "file.bin").unlink()
+    (tmpdir / "file.bin.part").write_bytes(data + data)
+    fpath = web.get_file("file.bin", f"{url}/file.bin", cache_dir=tmpdir)
+    assert Path(fpath).read_bytes() == data
+    assert not (tmpdir / "file.bin.part").exists()
+
+
+def test_get_file_no_ranges(tmp_path, server, handler):
+    url, root = server
+    data = bytes(range(256)) * 1000
+    (root / "file.bin").write_bytes(data)
+    tmpdir = tmp_path / "no_ranges"
+    tmpdir.mkdir()
+    (tmpdir / "file.bin.part").write_bytes(b"garbage")
+    (tmpdir / "file.bin.part.json").write_text(json.dumps({"url": f"{url}/file.bin", "ETag": "x"}))
+
+    handler.ranges = False
+    fpath = web.get_file("file.bin", f"{url}/file.bin", cache_dir=tmpdir)
+    assert handler.requests == [("/file.bin", "bytes=7-")]
+    assert Path(fpath).read_bytes() == data
+    assert not (tmpdir / "file.bin.part").exists()
+
+
+def test_get_file_segmented(tmp_path, server, handler):
+    url, root = server
+    data = os.urandom(1000003)
+    (root / "file.bin").write_bytes(data)
+
+    fpath = web.get_file("file.bin", f"{url}/file.bin", cache_dir=tmp_path / "seg", segments=4,
+                         chunk_size=4096)
+    assert Path(fpath).read_bytes() == data
+    assert not Path(f"{fpath}.part").exists()
+    # HEAD, then ranges
+    assert handler.requests[0] == ("/file.bin", None)
+    assert sorted(i[1] for i in handler.requests[1:]) == [
+        "bytes=0-250000", "bytes=250001-500001", "bytes=500002-750002", "bytes=750003-1000002"]
+
+    # interrupted: unresumable part removed
+    handler.truncate = 1000
+    with raises(IOError):
+        web.get_file("file.bin", f"{url}/file.bin", cache_dir=tmp_path / "trunc", segments=4)
+    assert not list((tmp_path / "trunc").iterdir())
+
+    # fallback
+    handler.ranges = False
+    handler.truncate = None
+    handler.requests.clear()
+    fpath = web.get_file("file.bin", f"{url}/file.bin", cache_dir=tmp_path / "single", segments=4)
+    assert Path(fpath).read_bytes() == data
+    assert handler.requests == [("/file.bin", None)] * 2
+
+    # fallback: `Range` ignored
+    handler.ranges = handler.ignore_range = True
+    handler.requests.clear()
+    fpath = web.get_file("file.bin", f"{url}/file.bin", cache_dir=tmp_path / "ignored", segments=4)
+    assert Path(fpath).read_bytes() == data
+    assert handler.requests[-1] == ("/file.bin", None)
+    assert [i.name for i in (tmp_path / "ignored").iterdir()] == ["file.bin"]
+
+    # fallback: `HEAD` rejected
+    handler.ignore_range = False
+    handler.head_status = 405
+    handler.requests.clear()
+    fpath = web.get_file("file.bin", f"{url}/file.bin", cache_dir=tmp_path / "nohead", segments=4)
+    assert Path(fpath).read_bytes() == data
+    assert handler.requests == [("/file.bin", None)] * 2
+
+
+def test_urlopen_cached_segmented(tmp_path, server, handler):
+    url, root = server
+    (root / "file.bin").write_bytes(b"foobar" * 1000)
+    outdir = tmp_path / "urlopen_cached"
+    with web.urlopen_cached(f"{url}/file.bin", outdir, segments=3) as fd:
+        assert fd.read() == b"foobar" * 1000
+    # `HEAD` rejected
+    handler.head_status = 405
+    with web.urlopen_cached(f"{url}/file.bin", tmp_path / "nohead", segments=3) as fd:
+        assert fd.read() == b"foobar" * 1000
+    assert (outdir / "file.bin.url").read_text() == f"{url}/file.bin"
+
+    # cached
+    (root / "file.bin").unlink()
+    with web.urlopen_cached(f"{url}/file.bin", outdir, segments=3) as fd:
+        assert fd.read() == b"foobar" * 1000
+
+
+def test_Cache(tmp_path, server, handler):
+    url, root = server
+    data = {"a.bin": b"foo" * 1000, "b.bin": b"foo" * 1000, "c.bin": b"bar" * 2000}
+    for fname, content in data.items():
+        (root / fname).write_bytes(content)
+    digest = {fname: sha256(content).hexdigest() for fname, content in data.items()}
+
+    cache = web.Cache(tmp_path / "cache")
+    fa = cache.get("a.bin", f"{url}/a.bin")
+    assert Path(fa).read_bytes() == data["a.bin"]
+    assert (tmp_path / "cache" / "objects" / digest["a.bin"]).is_file()
+    # hit
+    assert cache.get("a.bin", f"{url}/a.bin") == fa
+    assert len(handler.requests) == 1
+
+    # deduplicated
+    fb = cache.get("b.bin", f"{url}/b.bin")
+    assert Path(fb).read_bytes() == data["b.bin"]
+    assert len(list((tmp_path / "cache" / "objects").iterdir())) == 1
+    # known digest: no download
+    handler.requests.clear()
+    fd = cache.get("d.bin", f"{url}/missing.bin", sha256=digest["a.bin"])
+    assert Path(fd).read_bytes() == data["a.bin"]
+    assert not handler.requests
+
+    # integrity
+    with raises(ValueError):
+        cache.get("e.bin", f"{url}/c.bin", sha256=digest["a.bin"][::-1])
+    assert not (tmp_path / "cache" / "e.bin").exists()
+
+    # LRU eviction
+    cache.get("a.bin", f"{url}/a.bin")
+    cache.max_bytes = 7000
+    fc = cache.get("c.bin", f"{url}/c.bin")
+    assert Path(fc).read_bytes() == data["c.bin"]
+    assert not any(Path(i).exists() for i in (fa, fb, fd))
+    assert cache.evict(0) == ["c.bin"]
+    assert not Path(fc).exists()
+    assert not list((tmp_path / "cache" / "objects").iterdir())
+
+
+def test_Cache_concurrent(tmp_path, server, handler):
+    url, root = server
+    (root / "file.bin").write_bytes(b"foo" * 100000)
+    caches = [web.Cache(tmp_path / "cache") for _ in range(4)]
+    with ThreadPoolExecutor(4) as pool:
+        fpaths = list(pool.map(lambda cache: cache.get("file.bin", f"{url}/file.bin"), caches))
+    assert len(set(fpaths)) == 1
+    assert Path(fpaths[0]).read_bytes() == b"foo" * 100000
+    assert handler.requests == [("/file.bin", None)]
+
+
+def test_urlopen_cached_revalidate(tmp_path, server, handler, monkeypatch):
+    url, root = server
+    (root / "file.bin").write_bytes(b"foo")
+    outdir = tmp_path / "revalidate"
+    with web.urlopen_cached(f"{url}/file.bin", outdir, max_age=0) as fd:
+        assert fd.read() == b"foo"
+    assert "ETag" in json.loads((outdir / "file.bin.meta.json").read_text())
+
+    # not modified
+    handler.requests.clear()
+    with web.urlopen_cached(f"{url}/file.bin", outdir, max_age=0) as fd:
+        assert fd.read() == b"foo"
+    assert len(handler.requests) == 1
+
+    # fresh: not revalidated
+    (root / "file.bin").write_bytes(b"bar")
+    handler.requests.clear()
+    with web.urlopen_cached(f"{url}/file.bin", outdir, max_age=3600) as fd:
+        assert fd.read() == b"foo"
+    with web.urlopen_cached(f"{url}/file.bin", outdir) as fd:
+        assert fd.read() == b"foo"
+    assert not handler.requests
+
+    # modified: conditional response body cached
+    with web.urlopen_cached(f"{url}/file.bin", outdir, max_age=0) as fd:
+        assert fd.read() == b"bar"
+    assert len(handler.requests) == 1
+
+    # offline
+    (root / "file.bin").write_bytes(b"baz")
+    monkeypatch.setenv(web.OFFLINE_ENV, "1")
+    handler.requests.clear()
+    with web.urlopen_cached(f"{url}/file.bin", outdir, max_age=0) as fd:
+        assert fd.read() == b"bar"
+    with raises(IOError):
+        web.urlopen_cached(f"{url}/missing.bin", outdir)
+    assert not handler.requests
+
+
+def test_extractall_stream(tmp_path, server):
+    url, root = server
+    with ZipFile(root / "test.zip", "w") as zipf:
+        zipf.writestr("foo/bar.txt", b"foobar" * 1000)
+        zipf.writestr("baz.txt", b"baz")
+    with web.requests.get(f"{url}/test.zip", stream=True) as r:
+        extractall(r.raw, tmp_path / "out", include="foo/*")
+    assert (tmp_path / "out" / "foo" / "bar.txt").read_bytes() == b"foobar" * 1000
+    assert not (tmp_path / "out" / "baz.txt").exists()
+
+
 def test_urlopen_cached(tmp_path):
     tmpdir = tmp_path / "urlopen_cached"
     assert not tmpdir.exists()